@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import os
 from pathlib import Path
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -186,6 +187,83 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_TIME_LIMIT = 600  # 10分钟
 CELERY_TASK_SOFT_TIME_LIMIT = 580
+# 任务路由：交互式查询、按数据库类型划分的定时查询、脚本各用一个队列，见 dbquery/routing.py
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_ROUTES = ('dbquery.routing.route_task',)
+# 查询任务耗时长短不一，每个worker进程只预取一个任务，避免短任务排在长任务后面
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# 内置的定时任务，DatabaseScheduler 启动时同步到数据库，可在后台调整执行时间
+CELERY_BEAT_SCHEDULE = {
+    'dbquery-enforce-retention': {
+        'task': 'dbquery.tasks.enforce_retention',
+        'schedule': crontab(hour=3, minute=30),
+    },
+}
+
+# 查询遇到临时错误时的重试间隔：指数退避的基数和上限(秒)
+DBQUERY_RETRY_BACKOFF = int(os.getenv('DBQUERY_RETRY_BACKOFF', 10))
+DBQUERY_RETRY_BACKOFF_MAX = int(os.getenv('DBQUERY_RETRY_BACKOFF_MAX', 300))
+# 目标数据库连接池配置（每个Celery worker进程独立维护）
+DBQUERY_POOL_ENABLED = os.getenv('DBQUERY_POOL_ENABLED', 'True') == 'True'
+DBQUERY_POOL_MIN_SIZE = int(os.getenv('DBQUERY_POOL_MIN_SIZE', 0))  # 空闲回收时至少保留的连接数
+DBQUERY_POOL_MAX_SIZE = int(os.getenv('DBQUERY_POOL_MAX_SIZE', 4))  # 单个目标库的最大连接数
+DBQUERY_POOL_IDLE_TIMEOUT = int(os.getenv('DBQUERY_POOL_IDLE_TIMEOUT', 300))  # 空闲连接回收时间(秒)
+DBQUERY_POOL_CHECKOUT_TIMEOUT = int(os.getenv('DBQUERY_POOL_CHECKOUT_TIMEOUT', 30))  # 等待可用连接的超时时间(秒)
+# 查询结果每批读取的行数
+DBQUERY_FETCH_BATCH_SIZE = int(os.getenv('DBQUERY_FETCH_BATCH_SIZE', 1000))
+# Oracle行数限制下推的写法：fetch（12c及以上，FETCH FIRST）或rownum（兼容旧版本）
+DBQUERY_ORACLE_LIMIT_STYLE = os.getenv('DBQUERY_ORACLE_LIMIT_STYLE', 'fetch')
+# 查询结果分块存储：每个分块的行数，以及攒够多少个分块批量写入一次
+DBQUERY_RESULT_CHUNK_SIZE = int(os.getenv('DBQUERY_RESULT_CHUNK_SIZE', 1000))
+DBQUERY_RESULT_FLUSH_CHUNKS = int(os.getenv('DBQUERY_RESULT_FLUSH_CHUNKS', 10))
+# 结果数据的JSON后端：auto（安装了orjson就使用）、orjson、json
+DBQUERY_JSON_BACKEND = os.getenv('DBQUERY_JSON_BACKEND', 'auto')
+# 查询结果缓存：配置了REDIS_URL时使用Redis（多个worker共享），否则使用进程内缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dbquery': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'dbq',
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dbquery',
+    },
+}
+DBQUERY_CACHE_ALIAS = 'dbquery'
+DBQUERY_CACHE_WAIT_TIMEOUT = int(os.getenv('DBQUERY_CACHE_WAIT_TIMEOUT', 60))  # 等待相同查询执行完成的最长时间(秒)
+# SQL参数值在同一时间窗口(秒)内只计算一次，0表示每次都重新计算
+DBQUERY_PARAMETER_MEMO_WINDOW = int(os.getenv('DBQUERY_PARAMETER_MEMO_WINDOW', 60))
+# 目标库并发已满时重新排队的基础间隔(秒)，实际间隔在1~2倍之间随机
+DBQUERY_SLOT_RETRY_DELAY = int(os.getenv('DBQUERY_SLOT_RETRY_DELAY', 5))
+# 大结果文件存储：编码后超过阈值(字节)的结果写入文件，0 表示不使用；多个worker需要挂载同一目录
+DBQUERY_RESULT_FILE_DIR = os.getenv('DBQUERY_RESULT_FILE_DIR', os.path.join(BASE_DIR, 'result_files'))
+DBQUERY_RESULT_FILE_THRESHOLD = int(os.getenv('DBQUERY_RESULT_FILE_THRESHOLD', 8 * 1024 * 1024))
+# 保留策略的默认天数（查询实例、脚本上可以单独设置），0 表示不清理：
+# 超过结果保留天数只保留执行状态和耗时，超过记录保留天数整条删除
+DBQUERY_RESULT_RETENTION_DAYS = int(os.getenv('DBQUERY_RESULT_RETENTION_DAYS', 0))
+DBQUERY_SUMMARY_RETENTION_DAYS = int(os.getenv('DBQUERY_SUMMARY_RETENTION_DAYS', 0))
+DBQUERY_LOG_OUTPUT_RETENTION_DAYS = int(os.getenv('DBQUERY_LOG_OUTPUT_RETENTION_DAYS', 0))
+DBQUERY_LOG_RETENTION_DAYS = int(os.getenv('DBQUERY_LOG_RETENTION_DAYS', 0))
+# 清理时每批处理的条数、批次间隔(秒)和单次运行的最长时间(秒)
+DBQUERY_RETENTION_BATCH_SIZE = int(os.getenv('DBQUERY_RETENTION_BATCH_SIZE', 500))
+DBQUERY_RETENTION_BATCH_PAUSE = float(os.getenv('DBQUERY_RETENTION_BATCH_PAUSE', 0.2))
+DBQUERY_RETENTION_MAX_SECONDS = int(os.getenv('DBQUERY_RETENTION_MAX_SECONDS', 300))
+# 结果归档：开启后超过结果保留天数的结果移到压缩归档中（按月份和查询实例分文件），而不是清理；
+# 归档目录需要所有web和worker进程都能读取
+DBQUERY_ARCHIVE_ENABLED = os.getenv('DBQUERY_ARCHIVE_ENABLED', 'False') == 'True'
+DBQUERY_ARCHIVE_DIR = os.getenv('DBQUERY_ARCHIVE_DIR', os.path.join(BASE_DIR, 'result_archive'))
+# 结果分析：执行结果载入本地SQLite后执行SELECT，载入的文件缓存在目录中，总大小(字节)超过上限时淘汰最久未用的
+DBQUERY_ANALYTICS_DIR = os.getenv('DBQUERY_ANALYTICS_DIR', os.path.join(BASE_DIR, 'analytics_cache'))
+DBQUERY_ANALYTICS_CACHE_SIZE = int(os.getenv('DBQUERY_ANALYTICS_CACHE_SIZE', 1024 * 1024 * 1024))
+DBQUERY_ANALYTICS_MAX_LOAD_ROWS = int(os.getenv('DBQUERY_ANALYTICS_MAX_LOAD_ROWS', 1000000))  # 超过行数的结果不能分析
+DBQUERY_ANALYTICS_MAX_ROWS = int(os.getenv('DBQUERY_ANALYTICS_MAX_ROWS', 1000))  # 单次最多返回的行数
+DBQUERY_ANALYTICS_TIMEOUT = int(os.getenv('DBQUERY_ANALYTICS_TIMEOUT', 10))  # 单次执行的最长时间(秒)
+# 组合查询：来源结果载入工作目录下的临时SQLite文件（为空时使用系统临时目录），执行超过时间(秒)中止
+DBQUERY_COMPOSITE_WORK_DIR = os.getenv('DBQUERY_COMPOSITE_WORK_DIR') or None
+DBQUERY_COMPOSITE_TIMEOUT = int(os.getenv('DBQUERY_COMPOSITE_TIMEOUT', 300))
 
 # 邮件配置
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
@@ -16,9 +16,13 @@ from django.utils.html import format_html
 from django_celery_beat.models import PeriodicTask
 from import_export.admin import ImportExportModelAdmin
 
-from .models import DatabaseConnection, SQLParameter, QueryInstance, ExecutionResult, ExecutionLog
+from .models import CompositeQuery, CompositeSource, DatabaseConnection, SQLParameter, QueryInstance, ExecutionResult, ExecutionLog
 
 from .models import Script
+from .encoders import ResultJSONEncoder
+from .pool import invalidate_pool
+from .routing import cancel_execution, execute_composite_interactive
+from .storage import get_columns, has_rows, read_rows, rows_to_dicts
 # class NotificationConfigInline(admin.TabularInline):
 #     model = NotificationConfig
 #     extra = 1
@@ -81,6 +85,10 @@ class ScriptAdmin(admin.ModelAdmin):
         (None, {
             'fields': ('title', 'code')
         }),
+        ('保留策略', {
+            'fields': ('output_retention_days', 'log_retention_days'),
+            'classes': ('collapse',)
+        }),
         ('状态信息', {
             'fields': (
                 'status',
@@ -474,16 +482,32 @@ class ExecutionLogAdmin(admin.ModelAdmin):
 
 @admin.register(DatabaseConnection)
 class DatabaseConnectionAdmin(ImportExportModelAdmin): # 使用导入导出的模型
-    list_display = ('name', 'db_type', 'host', 'port', 'username', 'database', 'timeout', 'created_at', 'test_connection_link')
+    list_display = ('name', 'db_type', 'host', 'port', 'username', 'database', 'timeout', 'max_concurrency', 'created_at', 'test_connection_link')
     search_fields = ('name', 'host', 'database')
     list_filter = ('db_type', 'created_at')
     # 导入导出配置
     import_export_fields = (
-        'name', 'db_type', 'host', 'port', 'username', 'password', 'database', 'timeout'
+        'name', 'db_type', 'host', 'port', 'username', 'password', 'database', 'timeout', 'max_concurrency', 'queue'
     )
     export_fields = (
         'name', 'db_type', 'host', 'port', 'username', 'database', 'timeout', 'created_at'
     )
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # 配置修改后关闭旧连接池，其他worker进程会通过updated_at发现变化
+        invalidate_pool(obj.pk)
+
+    def delete_model(self, request, obj):
+        connection_id = obj.pk
+        super().delete_model(request, obj)
+        invalidate_pool(connection_id)
+
+    def delete_queryset(self, request, queryset):
+        connection_ids = list(queryset.values_list('pk', flat=True))
+        super().delete_queryset(request, queryset)
+        for connection_id in connection_ids:
+            invalidate_pool(connection_id)
+
     def test_connection_link(self, obj):
         return format_html('<a href="{}" class="button">测试连接</a>',
                           reverse('admin:test_database_connection', args=[obj.id]))
@@ -534,14 +558,26 @@ class QueryInstanceAdmin(ImportExportModelAdmin):
     list_per_page = 10
     # inlines = [NotificationConfigInline]
     form = QueryInstanceForm
-    list_display = ('name', 'connection', 'created_at', 'periodic_task_link', 'test_query_link')
+    list_display = ('name', 'connection', 'last_status', 'last_run_at', 'last_execution_time', 'created_at', 'periodic_task_link', 'test_query_link')
     search_fields = ('name', 'sql_template')
     list_filter = ('connection', 'created_at')
     filter_horizontal = ('parameters',)
+    readonly_fields = ('watermark_value',)
     fieldsets = (
         (None, {
             'fields': ('name', 'connection', 'sql_template', 'parameters')
         }),
+        ('执行配置', {
+            'fields': ('query_timeout', 'max_rows', 'push_down_limit', 'stream_results', 'use_bind_params', 'cache_ttl', 'delta_storage', 'snapshot_every'),
+        }),
+        ('增量查询', {
+            'fields': ('watermark_column', 'watermark_start', 'watermark_value'),
+            'classes': ('collapse',),
+        }),
+        ('保留策略', {
+            'fields': ('result_retention_days', 'summary_retention_days'),
+            'classes': ('collapse',),
+        }),
         ('定时任务配置', {
             'fields': ('periodic_task',),
             'description': '如需设置定时任务，请先保存查询实例，然后点击右侧链接创建定时任务。'
@@ -565,30 +601,72 @@ class QueryInstanceAdmin(ImportExportModelAdmin):
     test_query_link.allow_tags = True
 
 
+class CompositeSourceInline(admin.TabularInline):
+    model = CompositeSource
+    extra = 2
+    autocomplete_fields = ('query_instance',)
+
+
+@admin.register(CompositeQuery)
+class CompositeQueryAdmin(admin.ModelAdmin):
+    list_per_page = 10
+    inlines = [CompositeSourceInline]
+    list_display = ('name', 'refresh_sources', 'max_rows', 'updated_at', 'periodic_task_link')
+    search_fields = ('name', 'description', 'sql')
+    actions = ['execute_selected']
+
+    def periodic_task_link(self, obj):
+        return format_html('<a href="{}">创建定时任务</a>',
+                          reverse('admin:django_celery_beat_periodictask_add') + f'?name={obj.name}&task=dbquery.tasks.execute_composite&args=%5B{obj.id}%5D')
+    periodic_task_link.short_description = '定时任务'
+
+    def execute_selected(self, request, queryset):
+        for composite_query in queryset:
+            execute_composite_interactive(composite_query)
+        self.message_user(request, f'已提交 {queryset.count()} 个组合查询', messages.SUCCESS)
+    execute_selected.short_description = '执行选中的组合查询'
+
+
 @admin.register(ExecutionResult)
 class ExecutionResultAdmin(ImportExportModelAdmin):
-    list_display = ('query_instance', 'status', 'execution_time', 'created_at', 'view_result_link', 'export_result_link')
-    search_fields = ('query_instance__name', 'error_message')
-    list_filter = ('status', 'created_at', 'query_instance')
-    readonly_fields = ('query_instance', 'status', 'result_data', 'execution_time', 'error_message', 'created_at', 'rendered_sql')
+    list_display = ('query_instance', 'composite_query', 'status', 'row_count', 'byte_size', 'execution_time', 'cache_hits', 'created_at', 'view_result_link', 'export_result_link')
+    search_fields = ('query_instance__name', 'composite_query__name', 'error_message')
+    list_filter = ('status', 'pruned', 'created_at', 'query_instance')
+    list_select_related = ('query_instance', 'composite_query')
+    actions = ['cancel_selected']
+    readonly_fields = ('query_instance', 'composite_query', 'status', 'task_id', 'storage', 'result_format', 'row_count', 'byte_size', 'content_hash', 'file_path', 'checksum', 'columns', 'result_preview', 'result_data', 'truncated', 'pruned', 'base_result', 'delta', 'watermark', 'cache_hits', 'execution_time', 'slot_wait_time', 'attempts', 'attempt_log', 'error_message', 'created_at', 'rendered_sql')
 
     # 设置每页显示数量
     list_per_page = 10
 
+    # 详情页预览的行数，分块存储时只会读取第一个分块
+    preview_rows = 20
+
+    def result_preview(self, obj):
+        if not has_rows(obj):
+            return '无结果'
+        rows = rows_to_dicts(get_columns(obj), read_rows(obj, 0, self.preview_rows))
+        return format_html('<pre>{}</pre>', json.dumps(rows, ensure_ascii=False, indent=2, cls=ResultJSONEncoder))
+    result_preview.short_description = f'结果预览(前{preview_rows}行)'
 
     def view_result_link(self, obj):
-        if obj.status == 'success' and obj.result_data:
-            return format_html('<a href="/" target="_blank">查看结果</a>', json.dumps(obj.result_data)) 
+        if has_rows(obj):
+            return format_html('<a href="/" target="_blank">查看结果</a>', obj.pk)
 
         return '无结果'
     view_result_link.short_description = '查看结果'
 
     def export_result_link(self, obj):
-        if obj.status == 'success' and obj.result_data:
+        if has_rows(obj):
             return format_html('<a href="{}">导出结果</a>', reverse('export_result', args=[obj.id]))
         return '无结果'
     export_result_link.short_description = '导出结果'
 
+    def cancel_selected(self, request, queryset):
+        cancelled = sum(cancel_execution(result) for result in queryset.filter(status__in=('running', 'retrying')))
+        self.message_user(request, f'已取消 {cancelled} 个执行', messages.SUCCESS)
+    cancel_selected.short_description = '取消选中的执行'
+
     class Media:
         js = ('dbquery/js/result_viewer.js',)
 
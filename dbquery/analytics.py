@@ -0,0 +1,269 @@
+"""
+在已保存的执行结果上做筛选、分组和排序
+
+把一个执行结果载入本地的 SQLite 文件（表名 result），在上面执行用户提交的 SELECT，
+只把小的答案返回给浏览器，不需要下载整个结果，也不会再次查询目标库。
+
+载入的 SQLite 文件缓存在 DBQUERY_ANALYTICS_DIR 下，文件名包含结果的内容哈希，
+同一个结果只载入一次，多个 web 进程共用；总大小超过 DBQUERY_ANALYTICS_CACHE_SIZE 时
+删除最久没有使用的文件。
+
+用户 SQL 的限制：
+- 以只读方式打开数据库，授权回调只允许读取，拒绝写入、ATTACH、PRAGMA 等操作；
+- 一次只能执行一条语句；
+- 执行超过 DBQUERY_ANALYTICS_TIMEOUT 秒中止，最多返回 DBQUERY_ANALYTICS_MAX_ROWS 行。
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from django.conf import settings
+
+from .storage import count_rows, get_column_meta, iter_result_rows
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'result'
+INSERT_BATCH = 1000
+
+# 列类型 -> SQLite 列类型；未知类型不指定，值按原样保存
+_AFFINITIES = {
+    'integer': 'INTEGER',
+    'boolean': 'INTEGER',
+    'number': 'NUMERIC',
+    'string': 'TEXT',
+    'text': 'TEXT',
+    'date': 'TEXT',
+    'datetime': 'TEXT',
+    'time': 'TEXT',
+    'interval': 'TEXT',
+    'json': 'TEXT',
+}
+
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    getattr(sqlite3, 'SQLITE_RECURSIVE', 33),
+}
+
+# SQLite 整数的范围，超出的整数按文本保存
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+class AnalyticsError(Exception):
+    """结果无法分析或 SQL 不合法"""
+
+
+def get_analytics_dir():
+    return getattr(settings, 'DBQUERY_ANALYTICS_DIR', os.path.join(settings.BASE_DIR, 'analytics_cache'))
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def table_columns(result):
+    """载入后的列 [{'name': 列名, 'type': 类型}]，重复或空的列名会被改名（SQLite 列名不区分大小写）"""
+    columns = []
+    seen = set()
+    for index, column in enumerate(get_column_meta(result)):
+        name = column['name'] or f'column_{index + 1}'
+        base, suffix = name, 2
+        while name.lower() in seen:
+            name = f'{base}_{suffix}'
+            suffix += 1
+        seen.add(name.lower())
+        columns.append({'name': name, 'type': column.get('type', 'unknown')})
+    return columns
+
+
+def _sqlite_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, int) and not isinstance(value, bool) and not _INT_MIN <= value <= _INT_MAX:
+        return str(value)
+    return value
+
+
+def _cache_path(result):
+    # 内容哈希不同（例如旧数据没有哈希）时文件名不同，不会读到过期的缓存
+    key = (result.content_hash or 'nohash')[:16]
+    return os.path.join(get_analytics_dir(), f'result_{result.pk}_{key}.sqlite')
+
+
+def remove_cached(result_ids):
+    """删除这些结果已载入的缓存文件，结果被清理或删除后调用"""
+    directory = get_analytics_dir()
+    if not os.path.isdir(directory):
+        return
+    prefixes = tuple(f'result_{result_id}_' for result_id in result_ids)
+    if not prefixes:
+        return
+    for name in os.listdir(directory):
+        if name.startswith(prefixes) and name.endswith('.sqlite'):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def load_table(conn, table, result):
+    """在 conn 中创建表 table 并逐批写入 result 的行，不会把整个结果读进内存"""
+    columns = table_columns(result)
+    if not columns:
+        raise AnalyticsError(f'结果 {result.pk} 没有列信息，无法载入')
+    definition = ', '.join(
+        f'{_quote(column["name"])} {_AFFINITIES.get(column["type"], "")}'.rstrip() for column in columns
+    )
+    insert = f'INSERT INTO {_quote(table)} VALUES ({", ".join("?" * len(columns))})'
+    conn.execute(f'CREATE TABLE {_quote(table)} ({definition})')
+    batch = []
+    for row in iter_result_rows(result):
+        batch.append([_sqlite_value(value) for value in row])
+        if len(batch) >= INSERT_BATCH:
+            conn.executemany(insert, batch)
+            batch = []
+    if batch:
+        conn.executemany(insert, batch)
+    return columns
+
+
+def build_database(path, tables):
+    """把 {表名: 执行结果} 载入新的 SQLite 文件 path，写完后原子替换"""
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # 临时文件，写入失败直接删除，不需要日志和刷盘
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        for table, result in tables.items():
+            load_table(conn, table, result)
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    # 多个进程同时载入同一个结果时，后完成的覆盖先完成的，内容相同
+    os.replace(tmp_path, path)
+
+
+def _evict(keep):
+    """缓存总大小超过上限时，按最近使用时间删除旧文件"""
+    limit = getattr(settings, 'DBQUERY_ANALYTICS_CACHE_SIZE', 1024 * 1024 * 1024)
+    directory = get_analytics_dir()
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith('.sqlite'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_result(result):
+    """返回载入了 result 的 SQLite 文件路径，已有缓存时直接使用"""
+    if result.status != 'success':
+        raise AnalyticsError('只有成功的结果可以分析')
+    if result.pruned:
+        raise AnalyticsError('结果已超过保留期限被清理，不能分析')
+    max_rows = getattr(settings, 'DBQUERY_ANALYTICS_MAX_LOAD_ROWS', 1000000)
+    if max_rows and count_rows(result) > max_rows:
+        raise AnalyticsError(f'结果超过 {max_rows} 行，不能载入分析')
+    path = _cache_path(result)
+    if os.path.exists(path):
+        # 修改时间作为最近使用时间，淘汰时参考
+        os.utime(path)
+        return path
+    os.makedirs(get_analytics_dir(), exist_ok=True)
+    started = time.monotonic()
+    build_database(path, {TABLE_NAME: result})
+    logger.info(f"结果 {result.pk} 已载入分析缓存，耗时 {time.monotonic() - started:.2f}秒")
+    _evict(keep=path)
+    return path
+
+
+def _authorize(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def open_readonly(path, timeout):
+    """以只读方式打开 SQLite 文件，只允许读取，超过 timeout 秒的语句会被中止
+
+    返回 (连接, 截止时间)。
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    deadline = time.monotonic() + timeout
+    conn.set_authorizer(_authorize)
+    # 每执行一定数量的虚拟机指令检查一次，超时返回非零值中止查询
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+    if hasattr(conn, 'setlimit'):
+        conn.setlimit(sqlite3.SQLITE_LIMIT_LENGTH, 10 * 1024 * 1024)
+    return conn, deadline
+
+
+def execute_select(conn, sql, deadline, timeout):
+    """执行一条只读语句，返回游标；错误统一转换成 AnalyticsError"""
+    sql = (sql or '').strip().rstrip(';').strip()
+    if not sql:
+        raise AnalyticsError('SQL 不能为空')
+    try:
+        return conn.execute(sql)
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            raise AnalyticsError(f'执行超过 {timeout} 秒，已中止')
+        raise AnalyticsError(str(e))
+    except (sqlite3.DatabaseError, sqlite3.Warning) as e:
+        # 包括不允许的操作（授权失败）和多条语句
+        raise AnalyticsError(str(e))
+
+
+def fetch_rows(cursor, size, deadline, timeout):
+    try:
+        return cursor.fetchmany(size)
+    except sqlite3.OperationalError as e:
+        if time.monotonic() > deadline:
+            raise AnalyticsError(f'执行超过 {timeout} 秒，已中止')
+        raise AnalyticsError(str(e))
+
+
+def run_query(result, sql):
+    """在结果上执行一条 SELECT，返回 {'columns', 'rows', 'truncated', 'elapsed'}"""
+    if not (sql or '').strip():
+        raise AnalyticsError('SQL 不能为空')
+    path = load_result(result)
+    max_rows = getattr(settings, 'DBQUERY_ANALYTICS_MAX_ROWS', 1000)
+    timeout = getattr(settings, 'DBQUERY_ANALYTICS_TIMEOUT', 10)
+
+    started = time.monotonic()
+    conn, deadline = open_readonly(path, timeout)
+    try:
+        cursor = execute_select(conn, sql, deadline, timeout)
+        rows = fetch_rows(cursor, max_rows + 1, deadline, timeout)
+        columns = [description[0] for description in cursor.description or []]
+    finally:
+        conn.close()
+    return {
+        'columns': columns,
+        'rows': [list(row) for row in rows[:max_rows]],
+        'truncated': len(rows) > max_rows,
+        'elapsed': time.monotonic() - started,
+    }
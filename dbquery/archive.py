@@ -0,0 +1,265 @@
+"""
+过期结果的归档存储
+
+开启 DBQUERY_ARCHIVE_ENABLED 后，超过结果保留天数的执行结果不再清理，而是把数据移到
+DBQUERY_ARCHIVE_DIR 下的压缩归档里，按月份和查询实例分组::
+
+    <DBQUERY_ARCHIVE_DIR>/YYYY/MM/query_<查询实例id>.zip
+    <DBQUERY_ARCHIVE_DIR>/YYYY/MM/composite_<组合查询id>.zip
+
+每个结果是归档中的一个成员 result_<id>.jsonl：第一行是结果的元数据（查询、执行时间、SQL、列信息），
+之后每行是一行数据的 JSON 数组，脱离数据库也可以查看。数据库中只留下一个存根：
+storage 为 archived，file_path 指向归档文件，分块、结果文件都被删除。
+
+读取存根时（详情、导出）透明地从归档中解压读取，只能顺序读取，适合偶尔查看的历史数据。
+增量存储的结果归档时保存重建后的完整数据，不再依赖基准结果。
+
+向归档追加成员时先复制一份，写完后原子替换原文件，正在读取旧文件的进程不受影响；
+一次保留策略运行（ArchiveSession）中每个归档文件只复制、替换一次。
+归档只由保留策略任务写入，同一时间只有一个写入者。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .encoders import ResultJSONEncoder, decode_row, encode_row
+from .filestore import remove_file
+from .models import ExecutionResult, ExecutionResultChunk
+from .storage import get_column_meta, iter_result_rows
+
+logger = logging.getLogger(__name__)
+
+
+def archive_enabled():
+    return getattr(settings, 'DBQUERY_ARCHIVE_ENABLED', False)
+
+
+def get_archive_dir():
+    return getattr(settings, 'DBQUERY_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'result_archive'))
+
+
+def archive_path_for(result):
+    created = timezone.localtime(result.created_at)
+    if result.composite_query_id:
+        name = f'composite_{result.composite_query_id}.zip'
+    else:
+        name = f'query_{result.query_instance_id}.zip'
+    return os.path.join(created.strftime('%Y'), created.strftime('%m'), name)
+
+
+def member_name(result_id):
+    return f'result_{result_id}.jsonl'
+
+
+def _header(result, columns):
+    return {
+        'result': result.pk,
+        'query_instance': result.query_instance_id,
+        'composite_query': result.composite_query_id,
+        'query_name': result.source_name,
+        'created_at': result.created_at,
+        'execution_time': result.execution_time,
+        'row_count': result.row_count,
+        'truncated': result.truncated,
+        'rendered_sql': result.rendered_sql,
+        'columns': columns,
+    }
+
+
+def _encode_member(result, spool):
+    """把一个结果编码写进临时文件 spool，返回 (列信息, sha256)
+
+    先完整读出结果再写进归档：读取失败（结果文件丢失、基准不可读等）时归档里不会留下残缺的成员。
+    """
+    columns = get_column_meta(result)
+    checksum = hashlib.sha256()
+
+    def write(data):
+        spool.write(data)
+        checksum.update(data)
+    write(json.dumps(_header(result, columns), cls=ResultJSONEncoder, ensure_ascii=False).encode('utf-8') + b'\n')
+    for row in iter_result_rows(result):
+        write(encode_row(row) + b'\n')
+    return columns, checksum.hexdigest()
+
+
+def _read_member_info(archive, result_id):
+    checksum = hashlib.sha256()
+    with archive.open(member_name(result_id)) as member:
+        first = member.readline()
+        checksum.update(first)
+        for block in iter(lambda: member.read(1024 * 1024), b''):
+            checksum.update(block)
+    return json.loads(first)['columns'], checksum.hexdigest()
+
+
+class _PendingArchive:
+    """一个正在追加成员的归档文件：写的是副本，提交时才替换原文件"""
+
+    def __init__(self, relative_path):
+        self.relative_path = relative_path
+        self.path = os.path.join(get_archive_dir(), relative_path)
+        self.tmp_path = f'{self.path}.tmp'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if os.path.exists(self.path):
+            shutil.copyfile(self.path, self.tmp_path)
+        elif os.path.exists(self.tmp_path):
+            # 上次运行中断留下的副本
+            os.remove(self.tmp_path)
+        self.zip = zipfile.ZipFile(self.tmp_path, 'a', compression=zipfile.ZIP_DEFLATED)
+        self.existing = set(self.zip.namelist())
+        self.members = {}  # 执行结果 -> (列信息, sha256)
+        # 写归档本身出错（磁盘满等）时副本可能已经损坏，整个文件都不能提交
+        self.broken = False
+
+    def add(self, result, spool, info):
+        """把已经编码好的成员（spool）写进副本"""
+        name = member_name(result.pk)
+        try:
+            if name in self.existing:
+                # 上次归档写完文件但没有更新数据库时，成员已经存在，直接沿用
+                logger.warning(f"结果 {result.pk} 已在归档 {self.relative_path} 中，跳过写入")
+                info = _read_member_info(self.zip, result.pk)
+            else:
+                spool.seek(0)
+                with self.zip.open(name, 'w', force_zip64=True) as member:
+                    shutil.copyfileobj(spool, member, 1024 * 1024)
+                self.existing.add(name)
+        except Exception:
+            self.broken = True
+            raise
+        self.members[result] = info
+
+    def commit(self):
+        self.zip.close()
+        with open(self.tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            self.zip.close()
+        except Exception:
+            pass
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ArchiveSession:
+    """一次保留策略运行中的归档写入
+
+    各批结果先追加到对应归档文件的副本中，close() 时每个归档文件只替换一次，
+    替换之后才把结果改成存根，归档文件的复制开销与批次数无关。
+    单个结果读取失败时记录日志并跳过（记在 failed 中），不影响其他结果。
+    """
+
+    def __init__(self):
+        self._archives = {}
+        self.failed = set()
+        # 本次运行已经处理过（写入或失败）的结果id，之后的批次不再选取
+        self.processed = set()
+
+    def add(self, ids):
+        """把一批结果写进归档副本，返回写入的条数"""
+        results = (
+            ExecutionResult.objects.filter(pk__in=ids)
+            .select_related('query_instance', 'composite_query', 'base_result')
+            .order_by('created_at')
+        )
+        count = 0
+        for result in results:
+            relative_path = archive_path_for(result)
+            try:
+                with tempfile.TemporaryFile() as spool:
+                    # 先编码再打开归档，读取失败的结果不会让归档文件被复制
+                    info = _encode_member(result, spool)
+                    archive = self._archives.get(relative_path)
+                    if archive is None:
+                        archive = self._archives[relative_path] = _PendingArchive(relative_path)
+                    archive.add(result, spool, info)
+            except Exception as e:
+                logger.exception(f"结果 {result.pk} 归档失败，本次跳过: {e}")
+                self.failed.add(result.pk)
+                self.processed.add(result.pk)
+                continue
+            self.processed.add(result.pk)
+            count += 1
+        return count
+
+    def close(self):
+        """替换归档文件并把写入的结果改成存根，返回归档的条数"""
+        count = 0
+        archives, self._archives = self._archives, {}
+        for relative_path, archive in archives.items():
+            if archive.broken or not archive.members:
+                # 副本写坏了或者没有写入任何结果，原文件保持不变
+                archive.abort()
+                self.failed.update(result.pk for result in archive.members)
+                continue
+            try:
+                archive.commit()
+            except Exception as e:
+                logger.exception(f"归档文件 {relative_path} 写入失败: {e}")
+                archive.abort()
+                self.failed.update(result.pk for result in archive.members)
+                continue
+            count += _stub_results(relative_path, archive.members)
+        return count
+
+    def abort(self):
+        for archive in self._archives.values():
+            archive.abort()
+        self._archives = {}
+
+
+def _stub_results(relative_path, members):
+    """归档文件已经替换后，把结果改成指向归档的存根"""
+    file_paths = []
+    with transaction.atomic():
+        for result, (columns, checksum) in members.items():
+            if result.storage == ExecutionResult.STORAGE_FILE:
+                file_paths.append(result.file_path)
+            ExecutionResult.objects.filter(pk=result.pk).update(
+                storage=ExecutionResult.STORAGE_ARCHIVED,
+                result_format=ExecutionResult.FORMAT_COLUMNAR,
+                columns=columns,
+                result_data=None,
+                file_path=relative_path,
+                checksum=checksum,
+                base_result=None,
+                delta=None,
+            )
+        ExecutionResultChunk.objects.filter(result__in=list(members)).delete()
+    # 文件在事务提交之后再删，回滚时不会丢失数据
+    for file_path in file_paths:
+        remove_file(file_path)
+    return len(members)
+
+
+def archive_results(ids):
+    """把一批执行结果移到归档，数据库中只保留存根，返回归档的条数"""
+    session = ArchiveSession()
+    try:
+        session.add(ids)
+    except Exception:
+        session.abort()
+        raise
+    return session.close()
+
+
+def iter_archived_rows(result):
+    """从归档中顺序读取一个结果的行"""
+    path = os.path.join(get_archive_dir(), result.file_path)
+    with zipfile.ZipFile(path) as archive:
+        with archive.open(member_name(result.pk)) as member:
+            member.readline()  # 元数据
+            for line in member:
+                yield decode_row(line)
@@ -0,0 +1,142 @@
+"""
+组合查询：在多个查询实例的结果上做关联和汇总
+
+每个来源查询实例的结果以别名作为表名载入一个临时的 SQLite 文件（逐批写入，不把结果读进内存），
+组合 SQL 在这个文件上以只读方式执行（限制与 analytics.py 相同），输出边读边写成一个普通的
+执行结果，之后的详情、分页、导出、分析都与查询实例的结果相同。
+
+来源结果默认使用各查询实例最近一次成功的结果；组合查询设置了 refresh_sources 时，
+由任务 execute_composite 先并行执行所有来源查询（celery chord），全部完成后再组合。
+"""
+import logging
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .analytics import build_database, execute_select, fetch_rows, open_readonly
+from .delta import previous_result
+from .encoders import describe_columns
+from .models import ExecutionResult
+from .storage import ResultWriter
+
+logger = logging.getLogger(__name__)
+
+FETCH_SIZE = 1000
+
+
+class CompositeError(Exception):
+    """来源结果不可用或组合 SQL 执行失败"""
+
+
+def resolve_sources(composite_query, fresh=None):
+    """每个来源使用的执行结果，返回 {别名: 执行结果}
+
+    fresh 是本次刷新得到的 {别名: 执行结果id}，其余来源使用最近一次成功的结果。
+    """
+    fresh = fresh or {}
+    sources = {}
+    for link in composite_query.source_links.select_related('query_instance').order_by('pk'):
+        if link.alias in fresh:
+            result = ExecutionResult.objects.filter(pk=fresh[link.alias]).first()
+        else:
+            result = previous_result(link.query_instance)
+        if result is None or result.status != 'success':
+            raise CompositeError(f'来源查询 {link.query_instance.name}（{link.alias}）没有可用的成功结果')
+        if result.pruned:
+            raise CompositeError(f'来源查询 {link.query_instance.name}（{link.alias}）的结果已被清理')
+        sources[link.alias] = result
+    if not sources:
+        raise CompositeError('组合查询没有来源查询')
+    return sources
+
+
+def run_composite(composite_query, fresh=None, source_errors=None):
+    """执行组合查询并保存为执行结果，返回该执行结果
+
+    source_errors 是刷新来源时失败的来源 {别名: 错误信息}，不为空时直接记为失败。
+    """
+    start_time = time.time()
+    started_at = timezone.now()
+    execution_result = ExecutionResult.objects.create(
+        composite_query=composite_query,
+        status='running',
+        storage=ExecutionResult.STORAGE_CHUNKED,
+        result_format=ExecutionResult.FORMAT_COLUMNAR,
+        rendered_sql=composite_query.sql,
+        execution_time=0,
+    )
+    writer = ResultWriter(execution_result)
+    sources = {}
+    truncated = False
+    columns = []
+    timeout = getattr(settings, 'DBQUERY_COMPOSITE_TIMEOUT', 300)
+    max_rows = composite_query.max_rows
+
+    try:
+        if source_errors:
+            raise CompositeError('；'.join(f'来源 {alias} 执行失败: {error}' for alias, error in source_errors.items()))
+        sources = resolve_sources(composite_query, fresh)
+        work_dir = getattr(settings, 'DBQUERY_COMPOSITE_WORK_DIR', None)
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+            path = os.path.join(tmp, 'composite.sqlite')
+            build_database(path, sources)
+            conn, deadline = open_readonly(path, timeout)
+            try:
+                cursor = execute_select(conn, composite_query.sql, deadline, timeout)
+                columns = describe_columns('sqlite', cursor.description or [])
+                while True:
+                    size = FETCH_SIZE
+                    if max_rows:
+                        # 多取一行，用来判断结果是否被截断
+                        size = min(size, max_rows + 1 - writer.total_rows)
+                    batch = fetch_rows(cursor, size, deadline, timeout)
+                    if not batch:
+                        break
+                    if max_rows and writer.total_rows + len(batch) > max_rows:
+                        batch = batch[:max_rows - writer.total_rows]
+                        truncated = True
+                    writer.write_batch(batch, columns)
+                    if truncated:
+                        break
+            finally:
+                conn.close()
+        writer.close()
+    except Exception as e:
+        writer.discard()
+        execution_time = time.time() - start_time
+        logger.error(f"组合查询 {composite_query.name} 执行失败: {e}")
+        execution_result.status = 'failed'
+        execution_result.execution_time = execution_time
+        execution_result.error_message = str(e)
+        execution_result.attempt_log = [_attempt_entry(started_at, execution_time, sources, str(e))]
+        execution_result.save(update_fields=['status', 'execution_time', 'error_message', 'attempt_log'])
+        return execution_result
+
+    execution_time = time.time() - start_time
+    execution_result.status = 'success'
+    execution_result.row_count = writer.total_rows
+    execution_result.truncated = truncated
+    execution_result.columns = columns
+    execution_result.execution_time = execution_time
+    execution_result.attempt_log = [_attempt_entry(started_at, execution_time, sources)]
+    # writer.close() 已经设置了 byte_size、content_hash，大结果写入文件时还有 storage、file_path、checksum
+    execution_result.save(update_fields=[
+        'status', 'row_count', 'byte_size', 'content_hash', 'truncated', 'columns', 'execution_time',
+        'attempt_log', 'storage', 'file_path', 'checksum',
+    ])
+    logger.info(f"组合查询执行完成: {composite_query.name}, {writer.total_rows}行, 耗时: {execution_time:.2f}秒")
+    return execution_result
+
+
+def _attempt_entry(started_at, execution_time, sources, error_message=None):
+    """执行记录，sources 记下每个来源实际使用的执行结果"""
+    return {
+        'attempt': 1,
+        'started_at': timezone.localtime(started_at).isoformat(timespec='seconds'),
+        'execution_time': round(execution_time, 3),
+        'error': error_message,
+        'sources': {alias: result.pk for alias, result in sources.items()},
+    }
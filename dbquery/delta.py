@@ -0,0 +1,172 @@
+"""
+执行结果的增量存储
+
+开启 QueryInstance.delta_storage 后，一次执行的结果不再保存完整副本，而是与同一查询上一次的
+结果（基准）比较：按行内容的哈希找出基准中已有的行，只保存新增的行，再用一组操作记录结果的
+行顺序。每隔 snapshot_every 次或列发生变化时保存一次完整快照，限制重建时需要回溯的层数。
+
+ExecutionResult.delta 的格式::
+
+    {
+        'base': 基准结果的 id,
+        'depth': 距离最近一次完整快照的层数,
+        'ops': [['c', 基准行号, 行数] | ['i', 新增行序号, 行数], ...],
+        'inserted': 新增行数,
+        'deleted': 基准中没有保留的行数,
+    }
+
+'c' 表示从基准结果复制连续的若干行，'i' 表示依次取出若干条新增行。新增行按顺序保存在
+结果本身的分块或文件中，与普通结果相同。重建时基准结果需要整个读入内存，
+因此增量存储适合中小规模、每次变化不大的定时查询。
+"""
+import hashlib
+from collections import defaultdict, deque
+
+from .encoders import encode_row
+from .models import ExecutionResult
+from .storage import ResultWriter, get_column_meta, iter_result_rows, iter_stored_rows
+
+COPY = 'c'
+INSERT = 'i'
+
+
+def row_hash(encoded):
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+
+def previous_result(query_instance, before=None, composite_query=None):
+    """同一查询实例（或组合查询）上一次成功且数据还在的执行结果"""
+    results = ExecutionResult.objects.filter(
+        query_instance=query_instance, composite_query=composite_query, status='success', pruned=False
+    )
+    if before is not None:
+        results = results.filter(created_at__lt=before.created_at).exclude(pk=before.pk)
+    return results.order_by('-created_at', '-pk').first()
+
+
+def choose_base(query_instance):
+    """本次执行的比较基准；需要保存完整快照时返回 None"""
+    if not query_instance.delta_storage:
+        return None
+    base = previous_result(query_instance)
+    if base is None:
+        return None
+    depth = base.delta['depth'] if base.delta else 0
+    if depth + 1 >= max(query_instance.snapshot_every, 1):
+        return None
+    return base
+
+
+def _hash_index(rows):
+    """行哈希 -> 行号队列，相同内容的行按出现顺序依次匹配"""
+    index = defaultdict(deque)
+    for number, row in enumerate(rows):
+        index[row_hash(encode_row(row))].append(number)
+    return index
+
+
+class DeltaResultWriter(ResultWriter):
+    """与基准结果比较后只保存新增行的写入器
+
+    第一次收到列信息时，如果列与基准不同，就退回普通的完整保存。
+    """
+
+    def __init__(self, result, base, **kwargs):
+        super().__init__(result, **kwargs)
+        self.base = base
+        self._index = None
+        self._ops = []
+        self._copied = 0
+        self._total = 0
+
+    @property
+    def total_rows(self):
+        return self._total if self.base is not None else self.row_count
+
+    def write_batch(self, rows, columns=None):
+        if self.base is not None and self._index is None:
+            if [column['name'] for column in columns or []] != [column['name'] for column in get_column_meta(self.base)]:
+                self.base = None
+            else:
+                self._index = _hash_index(iter_result_rows(self.base))
+        super().write_batch(rows, columns)
+
+    def _append(self, encoded):
+        if self.base is None:
+            super()._append(encoded)
+            return
+        self._total += 1
+        numbers = self._index.get(row_hash(encoded))
+        if numbers:
+            self._add_op(COPY, numbers.popleft())
+            self._copied += 1
+        else:
+            self._add_op(INSERT, self._total - self._copied - 1)
+            super()._append(encoded)
+
+    def _add_op(self, kind, position):
+        # 与上一个操作连续时合并，基本不变的结果只有很少几个操作
+        if self._ops:
+            last = self._ops[-1]
+            if last[0] == kind and last[1] + last[2] == position:
+                last[2] += 1
+                return
+        self._ops.append([kind, position, 1])
+
+    def close(self):
+        super().close()
+        if self.base is not None:
+            base_depth = self.base.delta['depth'] if self.base.delta else 0
+            self.result.base_result = self.base
+            self.result.delta = {
+                'base': self.base.pk,
+                'depth': base_depth + 1,
+                'ops': self._ops,
+                'inserted': self._total - self._copied,
+                'deleted': (self.base.row_count or 0) - self._copied,
+            }
+        return self.total_rows
+
+
+def iter_delta_rows(result):
+    """按操作重建增量存储的结果"""
+    base_rows = list(iter_result_rows(result.base_result))
+    inserted = iter_stored_rows(result)
+    for kind, position, count in result.delta['ops']:
+        if kind == COPY:
+            yield from base_rows[position:position + count]
+        else:
+            for _ in range(count):
+                yield next(inserted)
+
+
+def compute_changes(result):
+    """与上一次结果相比新增和删除的行，返回 (上一次结果, 新增行, 删除行)
+
+    增量存储的结果直接使用保存的操作；完整保存的结果与上一次结果逐行比较哈希。
+    """
+    if result.delta:
+        base = result.base_result
+        inserted = list(iter_stored_rows(result))
+        kept = set()
+        for kind, position, count in result.delta['ops']:
+            if kind == COPY:
+                kept.update(range(position, position + count))
+        deleted = [row for number, row in enumerate(iter_result_rows(base)) if number not in kept]
+        return base, inserted, deleted
+
+    base = previous_result(result.query_instance, before=result, composite_query=result.composite_query)
+    if base is None:
+        return None, list(iter_result_rows(result)), []
+    base_rows = list(iter_result_rows(base))
+    index = _hash_index(base_rows)
+    kept = set()
+    inserted = []
+    for row in iter_result_rows(result):
+        numbers = index.get(row_hash(encode_row(row)))
+        if numbers:
+            kept.add(numbers.popleft())
+        else:
+            inserted.append(row)
+    deleted = [row for number, row in enumerate(base_rows) if number not in kept]
+    return base, inserted, deleted
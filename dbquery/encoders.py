@@ -0,0 +1,324 @@
+"""
+查询结果的编码
+
+写入结果时按列类型选择转换函数（在拿到 cursor.description 后只选一次），
+把驱动返回的 Decimal、date、bytes、timedelta、Oracle LOB 等值转换成 JSON 原生类型，
+之后由 JSONField 统一编码一次。安装了 orjson 时自动使用它作为 JSON 后端。
+"""
+import base64
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，没有安装时使用标准库 json
+    orjson = None
+
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 64位整数的范围，超出的整数（Oracle NUMBER(38)、PostgreSQL numeric 等）保留为字符串，orjson 无法编码
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def use_fast_json():
+    backend = getattr(settings, 'DBQUERY_JSON_BACKEND', 'auto')
+    return orjson is not None and backend in ('auto', 'orjson')
+
+
+def _read_lob(value):
+    # Oracle 的 CLOB/BLOB 需要 read() 才能拿到内容
+    return value.read() if hasattr(value, 'read') else value
+
+
+def _convert_decimal(value):
+    if not isinstance(value, decimal.Decimal):
+        return value
+    if value == value.to_integral_value():
+        number = int(value)
+        return number if _INT64_MIN <= number <= _INT64_MAX else str(number)
+    # 超过 float 精度的小数保留为字符串，避免丢失精度
+    if len(value.as_tuple().digits) > 15:
+        return str(value)
+    return float(value)
+
+
+def _convert_datetime(value):
+    if isinstance(value, datetime.datetime):
+        # 与 strftime(DATETIME_FORMAT) 结果相同，但快得多
+        return value.isoformat(' ', 'seconds')[:19]
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _convert_time(value):
+    # pymysql 把 TIME 列读成 timedelta
+    if isinstance(value, (datetime.time, datetime.timedelta)):
+        return str(value)
+    return value
+
+
+def _convert_binary(value):
+    value = _read_lob(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    return value
+
+
+def _convert_text(value):
+    return _read_lob(value)
+
+
+def convert_value(value):
+    """类型未知时逐个值判断的通用转换，无法转换时抛出 TypeError"""
+    if isinstance(value, decimal.Decimal):
+        return _convert_decimal(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return _convert_datetime(value)
+    if isinstance(value, (datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _convert_binary(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, 'read'):
+        return convert_value(value.read())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _convert_unknown(value):
+    if isinstance(value, (str, int, float, list, dict)):
+        return value
+    return convert_value(value)
+
+
+# 列类型 -> 转换函数；不在表中的类型（integer、string、boolean、json）原样写入
+CONVERTERS = {
+    'number': _convert_decimal,
+    'datetime': _convert_datetime,
+    'date': _convert_datetime,
+    'time': _convert_time,
+    'interval': _convert_time,
+    'binary': _convert_binary,
+    'text': _convert_text,
+    'unknown': _convert_unknown,
+}
+
+
+def register_converter(column_type_name, func):
+    """注册或替换某种列类型的转换函数"""
+    CONVERTERS[column_type_name] = func
+
+
+def build_row_converter(columns):
+    """根据列信息生成行转换函数，只对需要转换的列调用转换函数"""
+    converters = [
+        (index, CONVERTERS[column['type']])
+        for index, column in enumerate(columns)
+        if column.get('type') in CONVERTERS
+    ]
+    if not converters:
+        return list
+
+    def convert(row):
+        row = list(row)
+        for index, func in converters:
+            value = row[index]
+            if value is not None:
+                row[index] = func(value)
+        return row
+
+    return convert
+
+
+class EncodedJSON(str):
+    """已经编码好的 JSON 文本，ResultJSONEncoder 遇到时原样输出，不再重复编码"""
+
+
+def encode_row(row):
+    """把一行（已转换过的列表）编码成紧凑的 JSON bytes"""
+    if use_fast_json():
+        return orjson.dumps(row, default=convert_value, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(row, cls=ResultJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_rows(encoded_rows):
+    """把若干行编码结果拼成一个 JSON 数组"""
+    return EncodedJSON(b''.join((b'[', b','.join(encoded_rows), b']')).decode('utf-8'))
+
+
+def decode_row(data):
+    """解码一行，data 可以是 bytes 或 memoryview"""
+    if use_fast_json():
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+class ResultJSONEncoder(json.JSONEncoder):
+    """结果数据的 JSON 编码器，可用 orjson 加速"""
+
+    def default(self, obj):
+        try:
+            return convert_value(obj)
+        except TypeError:
+            return super().default(obj)
+
+    def encode(self, obj):
+        if isinstance(obj, EncodedJSON):
+            return str(obj)
+        # 需要缩进等格式化输出时仍走标准库
+        if use_fast_json() and self.indent is None:
+            # 日期交给 convert_value 处理，保持与标准库编码一致的格式
+            return orjson.dumps(
+                obj,
+                default=convert_value,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            ).decode('utf-8')
+        return super().encode(obj)
+
+
+class ResultJSONDecoder(json.JSONDecoder):
+    """结果数据的 JSON 解码器，可用 orjson 加速"""
+
+    def decode(self, s, *args, **kwargs):
+        if use_fast_json():
+            return orjson.loads(s)
+        return super().decode(s, *args, **kwargs)
+
+
+# 旧版本的编码器，保留给已有的迁移文件引用
+class DateTimeEncoder(ResultJSONEncoder):
+    pass
+
+
+# pymysql FIELD_TYPE 编号对应的类型
+_MYSQL_TYPES = {
+    0: 'number', 246: 'number', 4: 'number', 5: 'number',
+    1: 'integer', 2: 'integer', 3: 'integer', 8: 'integer', 9: 'integer', 13: 'integer',
+    7: 'datetime', 12: 'datetime',
+    10: 'date', 14: 'date',
+    11: 'time',
+    16: 'binary', 249: 'binary', 250: 'binary', 251: 'binary', 252: 'binary', 255: 'binary',
+    245: 'json',
+}
+
+# PostgreSQL 类型 OID 对应的类型
+_POSTGRESQL_TYPES = {
+    16: 'boolean',
+    20: 'integer', 21: 'integer', 23: 'integer',
+    700: 'number', 701: 'number', 1700: 'number',
+    1082: 'date',
+    1083: 'time', 1266: 'time',
+    1114: 'datetime', 1184: 'datetime',
+    1186: 'interval',
+    17: 'binary',
+    114: 'json', 3802: 'json',
+}
+
+# oracledb DbType 名称对应的类型
+_ORACLE_TYPES = {
+    'DB_TYPE_NUMBER': 'number', 'DB_TYPE_BINARY_DOUBLE': 'number', 'DB_TYPE_BINARY_FLOAT': 'number',
+    'DB_TYPE_BINARY_INTEGER': 'integer',
+    'DB_TYPE_DATE': 'datetime', 'DB_TYPE_TIMESTAMP': 'datetime',
+    'DB_TYPE_TIMESTAMP_TZ': 'datetime', 'DB_TYPE_TIMESTAMP_LTZ': 'datetime',
+    'DB_TYPE_INTERVAL_DS': 'interval',
+    'DB_TYPE_RAW': 'binary', 'DB_TYPE_LONG_RAW': 'binary', 'DB_TYPE_BLOB': 'binary',
+    'DB_TYPE_CLOB': 'text', 'DB_TYPE_NCLOB': 'text', 'DB_TYPE_LONG': 'text',
+    'DB_TYPE_BOOLEAN': 'boolean',
+    'DB_TYPE_JSON': 'json',
+}
+
+
+# PostgreSQL 常见类型 OID 对应的类型名，其余的记为 oid:<编号>
+_POSTGRESQL_TYPE_NAMES = {
+    16: 'bool', 17: 'bytea', 20: 'int8', 21: 'int2', 23: 'int4', 25: 'text', 114: 'json',
+    700: 'float4', 701: 'float8', 1042: 'bpchar', 1043: 'varchar', 1082: 'date', 1083: 'time',
+    1114: 'timestamp', 1184: 'timestamptz', 1186: 'interval', 1266: 'timetz', 1700: 'numeric',
+    2950: 'uuid', 3802: 'jsonb',
+}
+
+_mysql_type_names = None
+
+
+def _mysql_type_name(type_code):
+    global _mysql_type_names
+    if _mysql_type_names is None:
+        try:
+            from pymysql.constants import FIELD_TYPE
+            _mysql_type_names = {}
+            # CHAR、INTERVAL 是后面定义的别名，保留先出现的名字
+            for name, value in vars(FIELD_TYPE).items():
+                if name.isupper() and isinstance(value, int):
+                    _mysql_type_names.setdefault(value, name)
+        except ImportError:
+            _mysql_type_names = {}
+    return _mysql_type_names.get(type_code, str(type_code))
+
+
+def column_db_type(db_type, type_code):
+    """驱动报告的数据库原始类型名，取不到时返回空字符串"""
+    if type_code is None:
+        return ''
+    if db_type == 'mysql':
+        return _mysql_type_name(type_code)
+    if db_type == 'postgresql':
+        return _POSTGRESQL_TYPE_NAMES.get(type_code, f'oid:{type_code}')
+    if db_type == 'oracle':
+        name = getattr(type_code, 'name', str(type_code))
+        return name[len('DB_TYPE_'):] if name.startswith('DB_TYPE_') else name
+    if isinstance(type_code, type):
+        return type_code.__name__
+    return str(type_code)
+
+
+def describe_columns(db_type, description):
+    """由 cursor.description 生成列信息 [{'name', 'type', 'db_type', 'nullable'}]
+
+    nullable 取自 DB-API 的 null_ok，驱动不提供时为 None。
+    """
+    columns = []
+    for col in description:
+        null_ok = col[6] if len(col) > 6 else None
+        columns.append({
+            'name': col[0],
+            'type': column_type(db_type, col[1]),
+            'db_type': column_db_type(db_type, col[1]),
+            'nullable': None if null_ok is None else bool(null_ok),
+        })
+    return columns
+
+
+def column_type(db_type, type_code):
+    """把驱动返回的 cursor.description 类型码归一成通用的列类型名"""
+    if type_code is None:
+        return 'unknown'
+    if db_type == 'mysql':
+        return _MYSQL_TYPES.get(type_code, 'string')
+    if db_type == 'postgresql':
+        return _POSTGRESQL_TYPES.get(type_code, 'string')
+    if db_type == 'oracle':
+        return _ORACLE_TYPES.get(getattr(type_code, 'name', str(type_code)), 'string')
+    # pyodbc 等驱动直接给出 Python 类型
+    if isinstance(type_code, type):
+        if issubclass(type_code, bool):
+            return 'boolean'
+        if issubclass(type_code, int):
+            return 'integer'
+        if issubclass(type_code, (float, decimal.Decimal)):
+            return 'number'
+        if issubclass(type_code, datetime.datetime):
+            return 'datetime'
+        if issubclass(type_code, datetime.date):
+            return 'date'
+        if issubclass(type_code, datetime.time):
+            return 'time'
+        if issubclass(type_code, (bytes, bytearray)):
+            return 'binary'
+        if issubclass(type_code, str):
+            return 'string'
+    return 'unknown'
@@ -0,0 +1,125 @@
+"""
+查询错误的分类
+
+区分临时错误（网络中断、死锁、连接数已满等，稍后重试可能成功）和永久错误
+（语法错误、表不存在、没有权限、执行超时等，重试也不会成功）。只有临时错误才值得重试。
+"""
+import random
+import socket
+
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+
+from .pool import PoolTimeout
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# pymysql 错误码
+_MYSQL_TRANSIENT_CODES = {
+    1040,  # Too many connections
+    1053,  # Server shutdown in progress
+    1205,  # Lock wait timeout exceeded
+    1213,  # Deadlock found
+    1226,  # User has exceeded resource limit
+    2002, 2003, 2006, 2013,  # 无法连接 / 连接断开
+}
+
+# PostgreSQL SQLSTATE，前两位是错误类别
+_POSTGRESQL_TRANSIENT_CLASSES = {'08', '53'}  # 连接异常、资源不足
+_POSTGRESQL_TRANSIENT_CODES = {
+    '40001',  # serialization_failure
+    '40P01',  # deadlock_detected
+    '55P03',  # lock_not_available
+    '57P01', '57P02', '57P03',  # 服务端关闭或暂时不可用
+}
+# 连接阶段没有 SQLSTATE 时，libpq 的这些错误信息是配置问题，重试也不会成功
+_POSTGRESQL_PERMANENT_MESSAGES = (
+    'password authentication failed',
+    'no password supplied',
+    'no pg_hba.conf entry',
+    'does not exist',  # 数据库或角色不存在
+    'could not translate host name',  # 主机名无法解析
+)
+
+# oracledb 错误码
+_ORACLE_TRANSIENT_CODES = {
+    'ORA-00018', 'ORA-00020',  # 会话数、进程数已满
+    'ORA-00060',  # 死锁
+    'ORA-01033', 'ORA-01034', 'ORA-01089',  # 实例正在启动或关闭
+    'ORA-03113', 'ORA-03114', 'ORA-03135',  # 连接断开
+    'ORA-12170', 'ORA-12514', 'ORA-12516', 'ORA-12519', 'ORA-12520',
+    'ORA-12528', 'ORA-12537', 'ORA-12541', 'ORA-12543',  # 监听或网络问题
+    'DPY-4011',  # 连接已被关闭
+    'DPY-6005',  # 无法建立连接
+}
+
+
+def _classify_mysql(exc):
+    code = exc.args[0] if exc.args and isinstance(exc.args[0], int) else None
+    if code in _MYSQL_TRANSIENT_CODES:
+        return TRANSIENT
+    return PERMANENT
+
+
+def _classify_postgresql(exc):
+    code = getattr(exc, 'pgcode', None)
+    if code is None:
+        # 没有 SQLSTATE 的 OperationalError 是连接阶段的错误，认证失败、数据库不存在、主机名错误除外
+        if type(exc).__name__ != 'OperationalError':
+            return PERMANENT
+        message = str(exc)
+        if any(text in message for text in _POSTGRESQL_PERMANENT_MESSAGES):
+            return PERMANENT
+        return TRANSIENT
+    if code[:2] in _POSTGRESQL_TRANSIENT_CLASSES or code in _POSTGRESQL_TRANSIENT_CODES:
+        return TRANSIENT
+    return PERMANENT
+
+
+def _classify_oracle(exc):
+    error = exc.args[0] if exc.args else None
+    if getattr(error, 'isrecoverable', False):
+        return TRANSIENT
+    if getattr(error, 'full_code', None) in _ORACLE_TRANSIENT_CODES:
+        return TRANSIENT
+    return PERMANENT
+
+
+def _classify_odbc(exc):
+    state = exc.args[0] if exc.args and isinstance(exc.args[0], str) else ''
+    if state.startswith('08') or state == '40001':
+        return TRANSIENT
+    return PERMANENT
+
+
+_CLASSIFIERS = {
+    'mysql': _classify_mysql,
+    'postgresql': _classify_postgresql,
+    'oracle': _classify_oracle,
+    'sqlserver': _classify_odbc,
+}
+
+
+def classify_error(exc, db_type):
+    """判断一个查询异常是临时错误还是永久错误"""
+    if isinstance(exc, SoftTimeLimitExceeded):
+        return PERMANENT
+    if isinstance(exc, (PoolTimeout, ConnectionError, socket.timeout)):
+        return TRANSIENT
+    module = type(exc).__module__.split('.')[0]
+    if module in ('pymysql', 'psycopg2', 'oracledb', 'pyodbc'):
+        return _CLASSIFIERS.get(db_type, lambda e: PERMANENT)(exc)
+    return PERMANENT
+
+
+def is_transient(exc, db_type):
+    return classify_error(exc, db_type) == TRANSIENT
+
+
+def retry_countdown(retries):
+    """第 retries 次重试前等待的秒数：指数退避，随机取后一半，避免同一批任务同时重试"""
+    base = getattr(settings, 'DBQUERY_RETRY_BACKOFF', 10)
+    cap = getattr(settings, 'DBQUERY_RETRY_BACKOFF_MAX', 300)
+    delay = min(cap, base * 2 ** retries)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,233 @@
+"""
+目标库查询执行
+
+按数据库类型打开游标并分批读取结果。流式模式下使用服务端游标
+（pymysql SSCursor、psycopg2 命名游标、Oracle arraysize/prefetchrows），
+结果一批一批地交给调用方处理，worker 内存不随结果集大小增长。
+
+结果行统一以元组返回，列名和类型单独记录在 columns 中，不在每一行里重复列名。
+
+执行超时由目标库自己控制（MySQL MAX_EXECUTION_TIME、PostgreSQL statement_timeout、
+Oracle call_timeout、pyodbc 连接的 timeout），超时后目标库会中止语句。
+任务被软超时或撤销（revoke(terminate=True, signal='SIGUSR1')，见 routing.cancel_execution，
+由执行结果的 cancel 接口和后台的“取消选中的执行”调用）打断时，
+会向目标库发送取消请求（KILL QUERY、PQcancel、conn.cancel()），而不是只丢下连接不管。
+"""
+import logging
+import re
+import uuid
+
+import pymysql
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+
+from .encoders import describe_columns
+from .pool import create_connection
+
+logger = logging.getLogger(__name__)
+
+
+def get_batch_size():
+    return getattr(settings, 'DBQUERY_FETCH_BATCH_SIZE', 1000)
+
+
+# 开头的注释，跳过后判断语句类型
+_LEADING_COMMENTS_RE = re.compile(r'^(\s+|--[^\n]*(\n|$)|/\*.*?\*/)*', re.S)
+_SELECT_RE = re.compile(r'(select|with)\b|\(', re.I)
+# 语句末尾已有行数限制或锁定子句时不再追加
+_TRAILING_CLAUSE_RE = re.compile(
+    r'\b(limit\s+[\w%?:]+(\s*(,|offset)\s*[\w%?:]+)?'
+    r'|offset\s+[\w%?:]+\s+rows?(\s+fetch\s+(first|next)\s+[\w%?:]+\s+rows?\s+only)?'
+    r'|fetch\s+(first|next)\s+[\w%?:]+\s+rows?\s+only'
+    r'|for\s+update(\s+\w+)*|lock\s+in\s+share\s+mode)\s*$',
+    re.I,
+)
+
+
+def limit_sql(sql, db_type, limit):
+    """按数据库方言给查询加上行数限制，让目标库只计算和传输需要的行
+
+    只处理 SELECT/WITH 语句，已经带有 LIMIT、FETCH FIRST 或 FOR UPDATE 的语句保持不变。
+    限制子句另起一行追加，避免被末尾的行注释吃掉。
+    Oracle 默认使用 12c 起支持的 FETCH FIRST，DBQUERY_ORACLE_LIMIT_STYLE 为 rownum 时
+    改为外包一层 ROWNUM 过滤，兼容更早的版本。
+    """
+    body = sql.strip().rstrip(';').rstrip()
+    head = body[_LEADING_COMMENTS_RE.match(body).end():]
+    if not limit or not _SELECT_RE.match(head) or _TRAILING_CLAUSE_RE.search(body):
+        return sql
+    if db_type in ('mysql', 'postgresql'):
+        return f'{body}\nLIMIT {int(limit)}'
+    if db_type == 'oracle':
+        if getattr(settings, 'DBQUERY_ORACLE_LIMIT_STYLE', 'fetch') == 'rownum':
+            return f'SELECT * FROM (\n{body}\n) WHERE ROWNUM <= {int(limit)}'
+        return f'{body}\nFETCH FIRST {int(limit)} ROWS ONLY'
+    return sql
+
+
+# 任务被打断时抛出的异常，出现这些异常说明语句可能还在目标库上运行
+INTERRUPT_EXCEPTIONS = (SoftTimeLimitExceeded, SystemExit, KeyboardInterrupt)
+
+
+class QueryStream:
+    """在一个已取出的连接上执行 SQL，并按批次产出结果行
+
+    connection 是对应的 DatabaseConnection，MySQL 取消查询时需要用它另开一个连接。
+    """
+
+    def __init__(self, conn, db_type, stream=False, batch_size=None, max_rows=0, timeout=0, connection=None):
+        self.conn = conn
+        self.db_type = db_type
+        self.stream = stream
+        self.batch_size = batch_size or get_batch_size()
+        self.max_rows = max_rows or 0  # 0 表示不限制
+        self.timeout = timeout or 0    # 秒，0 表示不限制
+        self.connection = connection
+        self.columns = []  # [{'name': 列名, 'type': 类型, 'db_type': 数据库类型, 'nullable': 是否可空}]
+        self.row_count = 0
+        self.truncated = False
+        self.cancelled = False
+        self.cursor = None
+
+    def __enter__(self):
+        self._set_timeout(self.timeout)
+        self.cursor = self._open_cursor()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, INTERRUPT_EXCEPTIONS):
+            self.cancel()
+        try:
+            self.cursor.close()
+        except Exception:
+            # 流式游标在连接被提前关闭后 close 会报错，这里忽略即可
+            pass
+        if not self.cancelled:
+            self._reset_timeout()
+        return False
+
+    def _set_timeout(self, timeout):
+        milliseconds = int(timeout * 1000)
+        if self.db_type == 'mysql':
+            # 会话变量，连接池复用连接时每次都重新设置；只对 SELECT 生效
+            with self.conn.cursor() as cursor:
+                try:
+                    cursor.execute(f'SET SESSION MAX_EXECUTION_TIME = {milliseconds}')
+                except pymysql.MySQLError:
+                    # MariaDB 没有 MAX_EXECUTION_TIME，对应的变量单位是秒
+                    try:
+                        cursor.execute(f'SET SESSION max_statement_time = {milliseconds / 1000}')
+                    except pymysql.MySQLError as e:
+                        logger.warning(f"目标库不支持语句超时设置: {str(e)}")
+        elif self.db_type == 'postgresql':
+            # SET LOCAL 只在当前事务内有效，连接归还时 rollback 后自动恢复
+            with self.conn.cursor() as cursor:
+                cursor.execute(f'SET LOCAL statement_timeout = {milliseconds}')
+        elif self.db_type == 'oracle':
+            # 每次与服务端的往返都受这个时间限制
+            self.conn.call_timeout = milliseconds
+        elif self.db_type == 'sqlserver':
+            self.conn.timeout = int(timeout)
+
+    def _reset_timeout(self):
+        if not self.timeout:
+            return
+        try:
+            if self.db_type == 'oracle':
+                self.conn.call_timeout = 0
+            elif self.db_type == 'sqlserver':
+                self.conn.timeout = 0
+        except Exception:
+            pass
+
+    def cancel(self):
+        """通知目标库取消正在执行的语句，之后这个连接不再复用"""
+        self.cancelled = True
+        try:
+            if self.db_type == 'mysql':
+                # 原连接可能正阻塞在读取结果上，只能另开一个连接发送 KILL QUERY
+                killer = create_connection(self.connection)
+                try:
+                    with killer.cursor() as cursor:
+                        cursor.execute(f'KILL QUERY {self.conn.thread_id()}')
+                finally:
+                    killer.close()
+            elif self.db_type == 'postgresql':
+                # psycopg2 的 cancel 通过单独的取消请求通知服务端
+                self.conn.cancel()
+            elif self.db_type == 'oracle':
+                self.conn.cancel()
+            elif self.cursor is not None:
+                self.cursor.cancel()
+            logger.warning(f"查询被中断，已通知目标库取消执行({self.db_type})")
+        except Exception as e:
+            logger.warning(f"取消查询失败({self.db_type}): {str(e)}")
+        if self.db_type in ('mysql', 'oracle'):
+            # 被打断的连接状态不确定，关闭后连接池归还时会丢弃它
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+
+    def _open_cursor(self):
+        if self.db_type == 'mysql':
+            cursor_class = pymysql.cursors.SSCursor if self.stream else pymysql.cursors.Cursor
+            return self.conn.cursor(cursor_class)
+        elif self.db_type == 'postgresql':
+            if self.stream:
+                # 命名游标即服务端游标，每次 fetchmany 才从服务端取一批
+                cursor = self.conn.cursor(name=f'dbq_{uuid.uuid4().hex}')
+                cursor.itersize = self.batch_size
+                return cursor
+            return self.conn.cursor()
+        elif self.db_type == 'oracle':
+            cursor = self.conn.cursor()
+            if self.stream:
+                # 必须在 execute 之前设置才会生效
+                cursor.arraysize = self.batch_size
+                cursor.prefetchrows = self.batch_size + 1
+            return cursor
+        return self.conn.cursor()
+
+    def execute(self, sql, params=None):
+        # 绑定模式渲染出的 SQL 已把 % 转义成 %%，驱动只在传了参数时才还原，空参数也要传
+        if params is not None:
+            self.cursor.execute(sql, params)
+        else:
+            self.cursor.execute(sql)
+
+    @property
+    def column_names(self):
+        return [column['name'] for column in self.columns]
+
+    def batches(self):
+        """逐批产出结果行，达到 max_rows 后停止读取"""
+        while True:
+            size = self.batch_size
+            if self.max_rows:
+                size = min(size, self.max_rows - self.row_count)
+                if size <= 0:
+                    self._check_truncated()
+                    return
+            rows = self.cursor.fetchmany(size)
+            # 命名游标在第一次取数后才有 description
+            if not self.columns and self.cursor.description:
+                self.columns = describe_columns(self.db_type, self.cursor.description)
+            if not rows:
+                return
+            self.row_count += len(rows)
+            yield rows
+
+    def _check_truncated(self):
+        """已达到行数上限，再探测一行判断结果是否被截断"""
+        if self.cursor.fetchone() is None:
+            return
+        self.truncated = True
+        logger.warning(f"查询结果超过 {self.max_rows} 行，多余的行已丢弃")
+        if self.stream and self.db_type == 'mysql':
+            # 非缓冲游标关闭时会把剩余结果全部读完，直接断开连接更省事，
+            # 连接池归还时 rollback 失败会自动丢弃这个连接
+            try:
+                self.conn.close()
+            except Exception:
+                pass
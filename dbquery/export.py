@@ -0,0 +1,126 @@
+"""
+执行结果的流式导出
+
+支持 CSV、NDJSON（每行一个 JSON 对象）和 XLSX。行从存储中逐块读出、边读边写，
+内存占用与结果大小无关。CSV 和 NDJSON 在读到第一批行时就开始输出；
+XLSX 是 zip 格式，openpyxl 的 write_only 模式把行写进临时文件，整个工作簿生成后再分块输出。
+"""
+import csv
+import json
+import tempfile
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from .encoders import ResultJSONEncoder, encode_row
+from .storage import get_columns, iter_result_rows
+
+# 攒够多少字节输出一次，避免每行一次写入
+FLUSH_BYTES = 64 * 1024
+# 单个工作表的最大行数（含表头），超出后续写到新的工作表
+XLSX_MAX_ROWS = 1048576
+
+
+class _LineBuffer:
+    """csv.writer 的写入目标，只暂存当前这一行"""
+
+    def __init__(self):
+        self.value = ''
+
+    def write(self, value):
+        self.value += value
+
+    def pop(self):
+        value, self.value = self.value, ''
+        return value
+
+
+def _batched(pieces):
+    """把小段 bytes 合并成约 FLUSH_BYTES 大小的块"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= FLUSH_BYTES:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_csv(result):
+    line = _LineBuffer()
+    writer = csv.writer(line)
+    writer.writerow(get_columns(result))
+    # 表头单独输出，客户端立即开始接收
+    yield line.pop().encode('utf-8')
+
+    def lines():
+        for row in iter_result_rows(result):
+            writer.writerow(['' if value is None else value for value in row])
+            yield line.pop().encode('utf-8')
+    yield from _batched(lines())
+
+
+def iter_ndjson(result):
+    names = get_columns(result)
+
+    def lines():
+        for row in iter_result_rows(result):
+            yield encode_row(dict(zip(names, row))) + b'\n'
+    yield from _batched(lines())
+
+
+def _xlsx_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=ResultJSONEncoder, ensure_ascii=False)
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def iter_xlsx(result):
+    names = get_columns(result)
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = XLSX_MAX_ROWS
+    for row in iter_result_rows(result):
+        if sheet_rows >= XLSX_MAX_ROWS:
+            sheet = workbook.create_sheet(f'结果{len(workbook.worksheets) + 1}')
+            sheet.append(names)
+            sheet_rows = 1
+        sheet.append([_xlsx_value(value) for value in row])
+        sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet('结果1').append(names)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            block = output.read(FLUSH_BYTES)
+            if not block:
+                break
+            yield block
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv', iter_csv),
+    'ndjson': ('application/x-ndjson', 'ndjson', iter_ndjson),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', iter_xlsx),
+}
+
+
+def export_response(result, file_type='csv'):
+    """以 file_type 格式流式导出一个执行结果"""
+    content_type, extension, generate = EXPORT_FORMATS[file_type]
+    response = StreamingHttpResponse(generate(result), content_type=content_type)
+    filename = f'result_{result.id}_{timezone.now().strftime("%Y%m%d%H%M%S")}.{extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # 让反向代理不要缓冲整个响应
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,177 @@
+"""
+大结果的磁盘文件存储
+
+超过 DBQUERY_RESULT_FILE_THRESHOLD 的结果不再写入数据库，而是写到
+DBQUERY_RESULT_FILE_DIR 下的文件里，ExecutionResult 只保存相对路径、行数和校验和。
+
+文件格式（小端）::
+
+    MAGIC(8)
+    行记录 * N:   长度(uint32) + 行的 JSON 数组
+    稀疏索引:     每 INDEX_STEP 行记录一次行起始偏移(uint64)
+    尾部(28):     索引偏移(uint64) + 行数(uint64) + INDEX_STEP(uint32) + MAGIC(8)
+
+读取时通过 mmap 映射整个文件，按索引跳到目标行附近再顺着长度前缀向后走，
+行数据以 memoryview 切片的方式取出，不需要额外拷贝。
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DBQRES01'
+INDEX_STEP = 256
+_LENGTH = struct.Struct('<I')
+_OFFSET = struct.Struct('<Q')
+_TRAILER = struct.Struct('<QQI8s')
+
+
+class ResultFileError(Exception):
+    """结果文件损坏或格式不正确"""
+
+
+def get_file_dir():
+    return getattr(settings, 'DBQUERY_RESULT_FILE_DIR', os.path.join(settings.BASE_DIR, 'result_files'))
+
+
+def get_file_threshold():
+    """超过多少字节的结果写入文件，0 表示不使用文件存储"""
+    return getattr(settings, 'DBQUERY_RESULT_FILE_THRESHOLD', 0)
+
+
+def absolute_path(relative_path):
+    return os.path.join(get_file_dir(), relative_path)
+
+
+def relative_path_for(result):
+    created = result.created_at
+    return os.path.join(created.strftime('%Y'), created.strftime('%m'), f'result_{result.pk}.dbqr')
+
+
+class ResultFileWriter:
+    """顺序写入一个结果文件，同时计算 sha256 校验和"""
+
+    def __init__(self, relative_path):
+        self.relative_path = relative_path
+        self.path = absolute_path(relative_path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'wb')
+        self._hash = hashlib.sha256()
+        self._offset = 0
+        self._index = []
+        self.row_count = 0
+        self._write(MAGIC)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._hash.update(data)
+        self._offset += len(data)
+
+    def write_row(self, encoded_row):
+        """写入一行已编码好的 JSON 数组（bytes）"""
+        if self.row_count % INDEX_STEP == 0:
+            self._index.append(self._offset)
+        self._write(_LENGTH.pack(len(encoded_row)))
+        self._write(encoded_row)
+        self.row_count += 1
+
+    def close(self):
+        """写入索引和尾部，返回 (行数, 校验和, 文件大小)"""
+        index_offset = self._offset
+        for offset in self._index:
+            self._write(_OFFSET.pack(offset))
+        self._write(_TRAILER.pack(index_offset, self.row_count, INDEX_STEP, MAGIC))
+        self._file.close()
+        return self.row_count, self._hash.hexdigest(), self._offset
+
+    def discard(self):
+        self._file.close()
+        remove_file(self.relative_path)
+
+
+class ResultFile:
+    """通过 mmap 只读访问一个结果文件"""
+
+    def __init__(self, relative_path):
+        self.path = absolute_path(relative_path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ResultFileError(f'结果文件为空: {self.path}')
+        if len(self._mm) < len(MAGIC) + _TRAILER.size or self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ResultFileError(f'结果文件格式不正确: {self.path}')
+        index_offset, self.row_count, self.index_step, magic = _TRAILER.unpack_from(self._mm, len(self._mm) - _TRAILER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ResultFileError(f'结果文件不完整: {self.path}')
+        self._index_offset = index_offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def _row_position(self, row):
+        """定位第 row 行的起始偏移：先查稀疏索引，再沿长度前缀跳过剩余的行"""
+        slot = row // self.index_step
+        position = _OFFSET.unpack_from(self._mm, self._index_offset + slot * _OFFSET.size)[0]
+        for _ in range(row - slot * self.index_step):
+            position += _LENGTH.size + _LENGTH.unpack_from(self._mm, position)[0]
+        return position
+
+    def iter_raw_rows(self, offset=0, limit=None):
+        """逐行产出行数据的 memoryview，直接引用映射内存"""
+        stop = self.row_count if limit is None else min(self.row_count, offset + limit)
+        if offset >= stop:
+            return
+        view = memoryview(self._mm)
+        try:
+            position = self._row_position(offset)
+            for _ in range(offset, stop):
+                length = _LENGTH.unpack_from(self._mm, position)[0]
+                start = position + _LENGTH.size
+                yield view[start:start + length]
+                position = start + length
+        finally:
+            view.release()
+
+    def iter_rows(self, offset=0, limit=None):
+        from .encoders import decode_row
+        for raw in self.iter_raw_rows(offset, limit):
+            yield decode_row(raw)
+
+
+def verify_checksum(relative_path, checksum):
+    """重新计算文件的 sha256 并与记录的校验和比较"""
+    digest = hashlib.sha256()
+    with open(absolute_path(relative_path), 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest() == checksum
+
+
+def remove_file(relative_path):
+    if not relative_path:
+        return
+    try:
+        os.remove(absolute_path(relative_path))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除结果文件失败 {relative_path}: {str(e)}")
@@ -0,0 +1,114 @@
+"""
+增量查询的水位
+
+设置了 watermark_column 的查询实例每次执行时记录结果中该列的最大值（水位），
+下次执行时作为 {{ watermark }} 参数以绑定变量的形式传入，例如：
+
+    SELECT * FROM orders WHERE id > {{ watermark }} ORDER BY id
+
+水位在保存执行结果的同一个事务里更新，执行失败时保持不变，下次仍从原来的位置读取。
+结果被 max_rows 截断时水位取已读取行中的最大值，因此 SQL 需要按水位列升序排序。
+"""
+import datetime
+import decimal
+import logging
+
+from django.db import transaction
+
+from .encoders import convert_value
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_PARAM = 'watermark'
+
+
+def dump_watermark(value, column_type):
+    """水位的存储形式 {'value': JSON 值, 'type': 列类型}"""
+    if not isinstance(value, (str, int, float, bool)):
+        value = convert_value(value)
+    return {'value': value, 'type': column_type}
+
+
+def load_watermark(state):
+    """把存储的水位还原成可以绑定的 Python 值"""
+    if not state:
+        return None
+    value, column_type = state.get('value'), state.get('type')
+    if not isinstance(value, str):
+        return value
+    try:
+        if column_type == 'datetime':
+            return datetime.datetime.fromisoformat(value)
+        if column_type == 'date':
+            return datetime.date.fromisoformat(value)
+        if column_type == 'number':
+            return decimal.Decimal(value)
+    except ValueError:
+        pass
+    return value
+
+
+def current_watermark(query_instance):
+    """本次执行使用的水位，还没有执行过时使用初始水位"""
+    if query_instance.watermark_value:
+        return load_watermark(query_instance.watermark_value)
+    if query_instance.watermark_start == '':
+        raise ValueError(f"增量查询 {query_instance.name} 没有设置初始水位")
+    return query_instance.watermark_start
+
+
+class WatermarkTracker:
+    """在写入结果的同时记录水位列的最大值"""
+
+    def __init__(self, column):
+        self.column = column
+        self.index = None
+        self.column_type = None
+        self.max_value = None
+
+    def _find_column(self, columns):
+        for index, column in enumerate(columns):
+            # Oracle 返回的列名是大写的
+            if column['name'].lower() == self.column.lower():
+                self.index = index
+                self.column_type = column.get('type')
+                return
+        raise ValueError(f"结果中没有水位列 {self.column}")
+
+    def update(self, rows, columns):
+        if self.index is None:
+            self._find_column(columns)
+        values = [row[self.index] for row in rows if row[self.index] is not None]
+        if values:
+            batch_max = max(values)
+            if self.max_value is None or batch_max > self.max_value:
+                self.max_value = batch_max
+
+    def state(self):
+        if self.max_value is None:
+            return None
+        return dump_watermark(self.max_value, self.column_type)
+
+
+def advance_watermark(query_instance, state):
+    """把查询实例的水位推进到 state，只会前进不会后退；需要在事务中调用"""
+    from .models import QueryInstance
+    if state is None:
+        return
+    locked = QueryInstance.objects.select_for_update().only('watermark_value').get(pk=query_instance.pk)
+    current = load_watermark(locked.watermark_value)
+    new = load_watermark(state)
+    try:
+        if current is not None and not new > current:
+            return
+    except TypeError:
+        logger.warning(f"水位类型不一致，直接覆盖: {current!r} -> {new!r}")
+    QueryInstance.objects.filter(pk=query_instance.pk).update(watermark_value=state)
+    query_instance.watermark_value = state
+
+
+def save_with_watermark(execution_result, update_fields, query_instance, state):
+    """执行结果和水位在同一个事务里保存"""
+    with transaction.atomic():
+        execution_result.save(update_fields=update_fields)
+        advance_watermark(query_instance, state)
@@ -0,0 +1,61 @@
+"""
+目标库的并发限制
+
+每个 DatabaseConnection 可以设置同时执行的查询数上限（max_concurrency）。
+执行槽保存在共享缓存中（配置了 Redis 时所有 worker 共享，见 resultcache.get_cache），
+每个槽是一个键，用 cache.add 抢占，任务结束后释放；键带过期时间，worker 异常退出时
+占用的槽也会在任务硬超时之后自动释放。
+拿不到槽的任务不在 worker 里等待，而是稍后重新排队。
+"""
+import random
+import uuid
+
+from django.conf import settings
+
+from .resultcache import get_cache
+
+
+class ConcurrencyLimiter:
+    def __init__(self, connection):
+        self.connection = connection
+        self.limit = connection.max_concurrency
+        self.cache = get_cache()
+        self.slot_key = None
+        self._token = None
+
+    def _slot_keys(self):
+        return [f'dbquery:slot:{self.connection.pk}:{index}' for index in range(self.limit)]
+
+    def acquire(self):
+        """抢占一个执行槽，没有限制时总是成功"""
+        if not self.limit:
+            return True
+        token = uuid.uuid4().hex
+        timeout = getattr(settings, 'CELERY_TASK_TIME_LIMIT', 600)
+        keys = self._slot_keys()
+        # 从随机位置开始尝试，减少同时抢同一个槽的冲突
+        start = random.randrange(len(keys))
+        for key in keys[start:] + keys[:start]:
+            if self.cache.add(key, token, timeout=timeout):
+                self.slot_key = key
+                self._token = token
+                return True
+        return False
+
+    def release(self):
+        if self.slot_key is not None and self.cache.get(self.slot_key) == self._token:
+            self.cache.delete(self.slot_key)
+        self.slot_key = None
+        self._token = None
+
+    def in_use(self):
+        """当前被占用的槽数"""
+        if not self.limit:
+            return 0
+        return len(self.cache.get_many(self._slot_keys()))
+
+
+def requeue_countdown():
+    """拿不到执行槽时重新排队的等待时间，加上随机抖动避免一起重试"""
+    delay = getattr(settings, 'DBQUERY_SLOT_RETRY_DELAY', 5)
+    return delay + random.uniform(0, delay)
@@ -0,0 +1,114 @@
+"""
+结果编码的性能对比
+
+用合成数据比较旧的写入路径（字典行 + DateTimeEncoder + JSONField 二次编码）
+和新的写入路径（行数组 + 按列转换 + 一次编码）。不需要连接数据库：
+
+    python manage.py benchmark_result_encoding --rows 100000
+"""
+import datetime
+import decimal
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from dbquery import encoders
+from dbquery.encoders import ResultJSONDecoder, ResultJSONEncoder, build_row_converter
+
+
+class _LegacyDateTimeEncoder(json.JSONEncoder):
+    """与旧版本 tasks.DateTimeEncoder 相同"""
+
+    def default(self, obj):
+        if isinstance(obj, datetime.datetime):
+            return obj.strftime('%Y-%m-%d %H:%M:%S')
+        return super().default(obj)
+
+
+COLUMNS = [
+    {'name': 'id', 'type': 'integer'},
+    {'name': 'name', 'type': 'string'},
+    {'name': 'amount', 'type': 'number'},
+    {'name': 'created_at', 'type': 'datetime'},
+    {'name': 'remark', 'type': 'string'},
+]
+
+
+def make_rows(count, seed=0):
+    rnd = random.Random(seed)
+    base = datetime.datetime(2024, 1, 1)
+    rows = []
+    for i in range(count):
+        rows.append((
+            i,
+            f'customer_{rnd.randint(0, 99999)}',
+            rnd.random() * 1000,
+            base + datetime.timedelta(seconds=rnd.randint(0, 10 ** 7)),
+            None if i % 5 else 'vip',
+        ))
+    return rows
+
+
+def _timed(func):
+    start = time.perf_counter()
+    value = func()
+    return time.perf_counter() - start, value
+
+
+class Command(BaseCommand):
+    help = '比较旧的结果编码路径与新的按列转换 + 单次编码路径'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='合成结果的行数')
+        parser.add_argument('--repeat', type=int, default=3, help='每种方式重复次数，取最快的一次')
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        repeat = options['repeat']
+        rows = make_rows(count)
+        names = [column['name'] for column in COLUMNS]
+        self.stdout.write(f'合成数据: {count} 行, {len(COLUMNS)} 列, orjson: {"已安装" if encoders.orjson else "未安装"}')
+
+        def legacy_encode():
+            dict_rows = [dict(zip(names, row)) for row in rows]
+            text = json.dumps(dict_rows, cls=_LegacyDateTimeEncoder)
+            # 旧版本把字符串存进 JSONField，又被编码一次
+            return json.dumps(text)
+
+        def legacy_decode(stored):
+            return json.loads(json.loads(stored))
+
+        def columnar_encode():
+            convert = build_row_converter(COLUMNS)
+            return json.dumps([convert(row) for row in rows], cls=ResultJSONEncoder)
+
+        def columnar_decode(stored):
+            return json.loads(stored, cls=ResultJSONDecoder)
+
+        results = []
+        for label, encode, decode in (
+            ('旧路径(字典行, 二次编码)', legacy_encode, legacy_decode),
+            ('新路径(行数组, 单次编码)', columnar_encode, columnar_decode),
+        ):
+            encode_time, stored = min((_timed(encode) for _ in range(repeat)), key=lambda item: item[0])
+            decode_time = min(_timed(lambda: decode(stored))[0] for _ in range(repeat))
+            results.append((label, encode_time, decode_time, len(stored.encode('utf-8'))))
+
+        for label, encode_time, decode_time, size in results:
+            self.stdout.write(
+                f'{label}: 编码 {encode_time * 1000:.1f}ms, 解码 {decode_time * 1000:.1f}ms, 大小 {size / 1024 / 1024:.2f}MB'
+            )
+
+        # 旧编码器遇到 Decimal、date、bytes、timedelta 会直接报错，新路径可以处理
+        sample = [(1, decimal.Decimal('12.50'), datetime.date(2024, 1, 1), b'\x00\x01', datetime.timedelta(hours=1))]
+        sample_columns = [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'price', 'type': 'number'},
+            {'name': 'day', 'type': 'date'},
+            {'name': 'raw', 'type': 'binary'},
+            {'name': 'duration', 'type': 'time'},
+        ]
+        convert = build_row_converter(sample_columns)
+        self.stdout.write(f'扩展类型示例: {json.dumps([convert(row) for row in sample], cls=ResultJSONEncoder)}')
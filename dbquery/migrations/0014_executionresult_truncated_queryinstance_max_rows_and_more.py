@@ -0,0 +1,28 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0013_alter_executionlog_error_alter_executionlog_output_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='truncated',
+            field=models.BooleanField(default=False, verbose_name='结果已截断'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='max_rows',
+            field=models.PositiveIntegerField(default=1000, help_text='超出部分将被丢弃，0表示不限制', verbose_name='最大返回行数'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='stream_results',
+            field=models.BooleanField(default=False, help_text='使用服务端游标分批读取结果，适合大结果集', verbose_name='流式读取'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:04
+
+import dbquery.encoders
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0014_executionresult_truncated_queryinstance_max_rows_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='row_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='结果行数'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='storage',
+            field=models.CharField(choices=[('inline', '内联'), ('chunked', '分块')], default='inline', max_length=20, verbose_name='存储方式'),
+        ),
+        migrations.AlterField(
+            model_name='executionresult',
+            name='status',
+            field=models.CharField(choices=[('running', '执行中'), ('success', '成功'), ('failed', '失败')], max_length=20, verbose_name='执行状态'),
+        ),
+        migrations.CreateModel(
+            name='ExecutionResultChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveIntegerField(verbose_name='分块序号')),
+                ('start_row', models.PositiveIntegerField(verbose_name='起始行')),
+                ('end_row', models.PositiveIntegerField(verbose_name='结束行(不含)')),
+                ('payload', models.JSONField(encoder=dbquery.encoders.DateTimeEncoder, verbose_name='分块数据')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='dbquery.executionresult', verbose_name='执行结果')),
+            ],
+            options={
+                'verbose_name': '结果分块',
+                'verbose_name_plural': '结果分块',
+                'ordering': ['result', 'sequence'],
+                'indexes': [models.Index(fields=['result', 'start_row'], name='dbquery_exe_result__b0c408_idx')],
+                'unique_together': {('result', 'sequence')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0015_executionresult_row_count_executionresult_storage_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='columns',
+            field=models.JSONField(blank=True, null=True, verbose_name='列信息'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='result_format',
+            field=models.PositiveSmallIntegerField(choices=[(1, '字典行'), (2, '列式')], default=1, verbose_name='结果格式'),
+        ),
+    ]
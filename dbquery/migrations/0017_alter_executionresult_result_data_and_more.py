@@ -0,0 +1,24 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:07
+
+import dbquery.encoders
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0016_executionresult_columns_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='executionresult',
+            name='result_data',
+            field=models.JSONField(blank=True, decoder=dbquery.encoders.ResultJSONDecoder, encoder=dbquery.encoders.ResultJSONEncoder, null=True, verbose_name='结果数据'),
+        ),
+        migrations.AlterField(
+            model_name='executionresultchunk',
+            name='payload',
+            field=models.JSONField(decoder=dbquery.encoders.ResultJSONDecoder, encoder=dbquery.encoders.ResultJSONEncoder, verbose_name='分块数据'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0017_alter_executionresult_result_data_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='校验和(SHA-256)'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='file_path',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='结果文件'),
+        ),
+        migrations.AlterField(
+            model_name='executionresult',
+            name='storage',
+            field=models.CharField(choices=[('inline', '内联'), ('chunked', '分块'), ('file', '文件')], default='inline', max_length=20, verbose_name='存储方式'),
+        ),
+    ]
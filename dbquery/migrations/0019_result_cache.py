@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0018_result_file_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='cache_hits',
+            field=models.PositiveIntegerField(default=0, help_text='该结果被缓存复用、没有实际执行查询的次数', verbose_name='缓存命中次数'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='cache_ttl',
+            field=models.PositiveIntegerField(default=0, help_text='相同SQL在缓存时间内直接复用上次结果，0表示不缓存', verbose_name='结果缓存时间(秒)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0019_result_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queryinstance',
+            name='template_tokens',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='模板解析结果'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='use_bind_params',
+            field=models.BooleanField(default=False, help_text='参数值通过驱动的绑定变量传入，SQL文本不随参数变化；参数用于拼接表名等非值位置时会自动内联', verbose_name='使用绑定变量'),
+        ),
+    ]
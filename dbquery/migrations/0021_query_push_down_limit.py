@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0020_query_template_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queryinstance',
+            name='push_down_limit',
+            field=models.BooleanField(default=False, help_text='执行前按数据库方言给SQL加上LIMIT/FETCH FIRST，让目标库只返回需要的行', verbose_name='行数限制下推'),
+        ),
+    ]
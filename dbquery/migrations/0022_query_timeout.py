@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0021_query_push_down_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queryinstance',
+            name='query_timeout',
+            field=models.PositiveIntegerField(default=0, help_text='由目标库强制执行，超时后语句被中止；0表示使用数据库连接的超时时间', verbose_name='执行超时时间(秒)'),
+        ),
+    ]
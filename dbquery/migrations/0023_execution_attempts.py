@@ -0,0 +1,28 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0022_query_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='attempt_log',
+            field=models.JSONField(blank=True, help_text='每次尝试的开始时间、耗时和错误信息', null=True, verbose_name='执行记录'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='执行次数'),
+        ),
+        migrations.AlterField(
+            model_name='executionresult',
+            name='status',
+            field=models.CharField(choices=[('running', '执行中'), ('retrying', '等待重试'), ('success', '成功'), ('failed', '失败')], max_length=20, verbose_name='执行状态'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0023_execution_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='databaseconnection',
+            name='max_concurrency',
+            field=models.PositiveIntegerField(default=0, help_text='所有worker合计同时在该库上执行的查询数，超出的任务稍后重新排队；0表示不限制', verbose_name='最大并发查询数'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='slot_wait_time',
+            field=models.FloatField(default=0, help_text='目标库并发已满时等待执行槽的时间', verbose_name='排队等待时间(秒)'),
+        ),
+    ]
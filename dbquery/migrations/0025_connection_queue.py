@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0024_connection_concurrency_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='databaseconnection',
+            name='queue',
+            field=models.CharField(blank=True, default='', help_text='定时查询进入的Celery队列，留空时按数据库类型进入 dbq.<类型> 队列；需要有worker消费该队列', max_length=100, verbose_name='专用队列'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0025_connection_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='watermark',
+            field=models.JSONField(blank=True, help_text='增量查询本次执行前后的水位', null=True, verbose_name='水位'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='watermark_column',
+            field=models.CharField(blank=True, default='', help_text='设置后按增量方式执行：SQL中用 {{ watermark }} 引用上次结果中该列的最大值，SQL需要按该列升序排序', max_length=100, verbose_name='水位列'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='watermark_start',
+            field=models.CharField(blank=True, default='', help_text='第一次执行时 {{ watermark }} 的值', max_length=100, verbose_name='初始水位'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='watermark_value',
+            field=models.JSONField(blank=True, editable=False, null=True, verbose_name='当前水位'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0026_incremental_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='base_result',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='delta_results', to='dbquery.executionresult', verbose_name='增量基准结果'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='delta',
+            field=models.JSONField(blank=True, help_text='相对基准结果的行操作，为空表示完整保存', null=True, verbose_name='增量信息'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='delta_storage',
+            field=models.BooleanField(default=False, help_text='只保存与上一次结果相比变化的行，读取时自动重建', verbose_name='增量存储结果'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='snapshot_every',
+            field=models.PositiveIntegerField(default=10, help_text='增量存储时每隔多少次执行保存一次完整结果', verbose_name='完整快照间隔'),
+        ),
+    ]
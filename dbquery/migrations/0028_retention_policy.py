@@ -0,0 +1,46 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0027_delta_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='pruned',
+            field=models.BooleanField(default=False, help_text='超过保留期限，结果数据已删除，只保留状态和耗时', verbose_name='结果已清理'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='result_retention_days',
+            field=models.PositiveIntegerField(default=0, help_text='超过天数的执行结果清理结果数据，只保留状态和耗时；0表示使用全局设置', verbose_name='结果保留天数'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='summary_retention_days',
+            field=models.PositiveIntegerField(default=0, help_text='超过天数的执行结果整条删除；0表示使用全局设置', verbose_name='执行记录保留天数'),
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='log_retention_days',
+            field=models.PositiveIntegerField(default=0, help_text='超过天数的执行日志整条删除；0表示使用全局设置', verbose_name='日志保留天数'),
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='output_retention_days',
+            field=models.PositiveIntegerField(default=0, help_text='超过天数的执行日志清空输出内容；0表示使用全局设置', verbose_name='输出保留天数'),
+        ),
+        migrations.AddIndex(
+            model_name='executionlog',
+            index=models.Index(fields=['executed_at'], name='dbquery_exe_execute_39969d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='executionresult',
+            index=models.Index(fields=['created_at'], name='dbquery_exe_created_5e25bf_idx'),
+        ),
+    ]
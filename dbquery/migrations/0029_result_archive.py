@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0028_retention_policy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='executionresult',
+            name='file_path',
+            field=models.CharField(blank=True, help_text='文件存储时是结果文件，归档后是归档文件的相对路径', max_length=255, null=True, verbose_name='结果文件'),
+        ),
+        migrations.AlterField(
+            model_name='executionresult',
+            name='storage',
+            field=models.CharField(choices=[('inline', '内联'), ('chunked', '分块'), ('file', '文件'), ('archived', '已归档')], default='inline', max_length=20, verbose_name='存储方式'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:27
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_latest_result(apps, schema_editor):
+    QueryInstance = apps.get_model('dbquery', 'QueryInstance')
+    ExecutionResult = apps.get_model('dbquery', 'ExecutionResult')
+    latest = ExecutionResult.objects.filter(query_instance=OuterRef('pk')).order_by('-created_at', '-pk')
+    QueryInstance.objects.update(
+        latest_result=Subquery(latest.values('pk')[:1]),
+        last_status=Coalesce(Subquery(latest.values('status')[:1]), Value('')),
+        last_run_at=Subquery(latest.values('created_at')[:1]),
+        last_execution_time=Subquery(latest.values('execution_time')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0029_result_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queryinstance',
+            name='last_execution_time',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='最近执行耗时(秒)'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='last_run_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='最近执行时间'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='last_status',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20, verbose_name='最近执行状态'),
+        ),
+        migrations.AddField(
+            model_name='queryinstance',
+            name='latest_result',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='latest_for', to='dbquery.executionresult', verbose_name='最近执行结果'),
+        ),
+        migrations.AddIndex(
+            model_name='executionresult',
+            index=models.Index(fields=['query_instance', 'created_at'], name='dbquery_exe_query_i_aab305_idx'),
+        ),
+        migrations.RunPython(fill_latest_result, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0030_latest_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='byte_size',
+            field=models.BigIntegerField(blank=True, help_text='所有行编码成JSON后的大小', null=True, verbose_name='结果大小(字节)'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='按顺序对每行JSON计算的SHA-256，与存储方式无关，内容相同的结果哈希相同', max_length=64, null=True, verbose_name='内容哈希'),
+        ),
+    ]
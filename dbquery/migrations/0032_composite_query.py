@@ -0,0 +1,61 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:36
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0031_result_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompositeQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='名称')),
+                ('description', models.TextField(blank=True, default='', verbose_name='描述')),
+                ('sql', models.TextField(help_text='SQLite语法，来源查询的结果以别名作为表名，例如 SELECT * FROM a JOIN b ON a.id = b.id', verbose_name='组合SQL')),
+                ('refresh_sources', models.BooleanField(default=False, help_text='先并行执行所有来源查询，再用新结果组合；否则使用各来源最近一次成功的结果', verbose_name='执行前刷新来源')),
+                ('max_rows', models.PositiveIntegerField(default=0, help_text='超出部分将被丢弃，0表示不限制', verbose_name='最大返回行数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '组合查询',
+                'verbose_name_plural': '组合查询',
+            },
+        ),
+        migrations.AlterField(
+            model_name='executionresult',
+            name='query_instance',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='dbquery.queryinstance', verbose_name='查询实例'),
+        ),
+        migrations.CreateModel(
+            name='CompositeSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=50, validators=[django.core.validators.RegexValidator('^[A-Za-z_][A-Za-z0-9_]*$', '表名只能包含字母、数字和下划线，且不能以数字开头')], verbose_name='表名')),
+                ('composite_query', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='source_links', to='dbquery.compositequery', verbose_name='组合查询')),
+                ('query_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='composite_links', to='dbquery.queryinstance', verbose_name='查询实例')),
+            ],
+            options={
+                'verbose_name': '组合查询来源',
+                'verbose_name_plural': '组合查询来源',
+                'unique_together': {('composite_query', 'alias')},
+            },
+        ),
+        migrations.AddField(
+            model_name='compositequery',
+            name='sources',
+            field=models.ManyToManyField(related_name='composite_queries', through='dbquery.CompositeSource', to='dbquery.queryinstance', verbose_name='来源查询'),
+        ),
+        migrations.AddField(
+            model_name='executionresult',
+            name='composite_query',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='dbquery.compositequery', verbose_name='组合查询'),
+        ),
+    ]
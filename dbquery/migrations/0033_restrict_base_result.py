@@ -0,0 +1,19 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0032_composite_query'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='executionresult',
+            name='base_result',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='delta_results', to='dbquery.executionresult', verbose_name='增量基准结果'),
+        ),
+    ]
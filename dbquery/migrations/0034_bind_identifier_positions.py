@@ -0,0 +1,30 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+from dbquery.sqltemplate import parse_template
+
+
+def reparse_templates(apps, schema_editor):
+    """标识符位置的占位符改为内联，按新规则重新解析已保存的模板"""
+    QueryInstance = apps.get_model('dbquery', 'QueryInstance')
+    for query_instance in QueryInstance.objects.only('pk', 'sql_template').iterator():
+        QueryInstance.objects.filter(pk=query_instance.pk).update(
+            template_tokens=parse_template(query_instance.sql_template)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0033_restrict_base_result'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queryinstance',
+            name='use_bind_params',
+            field=models.BooleanField(default=False, help_text='参数值通过驱动的绑定变量传入，SQL文本不随参数变化；处在表名、列名位置（FROM/JOIN/INTO/UPDATE/TABLE/BY之后或与.相连）、与其他文字相连或写在字符串中间的参数仍然内联', verbose_name='使用绑定变量'),
+        ),
+        migrations.RunPython(reparse_templates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0034_bind_identifier_positions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queryinstance',
+            name='query_timeout',
+            field=models.PositiveIntegerField(default=0, help_text='由目标库强制执行，超时后语句被中止；0表示使用任务的时间限制(CELERY_TASK_SOFT_TIME_LIMIT)', verbose_name='执行超时时间(秒)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.21 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dbquery', '0035_query_timeout_fallback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='executionresult',
+            name='task_id',
+            field=models.CharField(blank=True, editable=False, help_text='正在执行这个结果的 celery 任务，取消执行时使用', max_length=255, null=True, verbose_name='任务ID'),
+        ),
+    ]
@@ -3,11 +3,22 @@ import traceback
 from io import StringIO
 
 # User
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
-from django.db import models
+from django.core.validators import RegexValidator
+from django.db import models, transaction
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django_celery_beat.models import PeriodicTask
 
+from .encoders import ResultJSONDecoder, ResultJSONEncoder
+from .filestore import remove_file
+from .parameters import evaluate_parameter
+from .sqltemplate import parse_template, render_bind, render_inline
+
 
 class DatabaseConnection(models.Model):
     DB_TYPES = (
@@ -23,6 +34,8 @@ class DatabaseConnection(models.Model):
     password = models.CharField(max_length=255, verbose_name='密码')
     database = models.CharField(max_length=100, verbose_name='数据库名称')
     timeout = models.IntegerField(default=30, verbose_name='查询超时时间(秒)')
+    queue = models.CharField(max_length=100, blank=True, default='', verbose_name='专用队列', help_text='定时查询进入的Celery队列，留空时按数据库类型进入 dbq.<类型> 队列；需要有worker消费该队列')
+    max_concurrency = models.PositiveIntegerField(default=0, verbose_name='最大并发查询数', help_text='所有worker合计同时在该库上执行的查询数，超出的任务稍后重新排队；0表示不限制')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
@@ -45,30 +58,8 @@ class SQLParameter(models.Model):
         return self.name
 
     def evaluate(self):
-        try:
-            # 安全执行Python代码，导入常用模块
-            import datetime
-            import time
-            import math
-            import json
-            import re
-            global_vars = {
-                'datetime': datetime,
-                'time': time,
-                'math': math,
-                'json': json,
-                're': re
-            }
-            local_vars = {}
-            # 使用eval执行表达式并直接获取返回值
-            result = eval(self.python_code, global_vars, local_vars)
-            return result
-            # 否则返回第一个变量值
-            return list(local_vars.values())[0] if local_vars else None
-        except Exception as e:
-            error_msg = f"Error: {str(e)}"
-            logger.error(f"参数计算错误: {error_msg}")
-            return error_msg
+        """计算参数值，代码编译结果和同一时间窗口内的值都会被复用，见 parameters 模块"""
+        return evaluate_parameter(self)
 
     class Meta:
         verbose_name = 'SQL参数'
@@ -81,25 +72,82 @@ class QueryInstance(models.Model):
     sql_template = models.TextField(verbose_name='SQL模板')
     parameters = models.ManyToManyField(SQLParameter, blank=True, related_name='query_instances', verbose_name='参数')
     # result_table = models.CharField(max_length=100, verbose_name='结果表名')
+    max_rows = models.PositiveIntegerField(default=1000, verbose_name='最大返回行数', help_text='超出部分将被丢弃，0表示不限制')
+    query_timeout = models.PositiveIntegerField(default=0, verbose_name='执行超时时间(秒)', help_text='由目标库强制执行，超时后语句被中止；0表示使用任务的时间限制(CELERY_TASK_SOFT_TIME_LIMIT)')
+    push_down_limit = models.BooleanField(default=False, verbose_name='行数限制下推', help_text='执行前按数据库方言给SQL加上LIMIT/FETCH FIRST，让目标库只返回需要的行')
+    stream_results = models.BooleanField(default=False, verbose_name='流式读取', help_text='使用服务端游标分批读取结果，适合大结果集')
+    use_bind_params = models.BooleanField(default=False, verbose_name='使用绑定变量', help_text='参数值通过驱动的绑定变量传入，SQL文本不随参数变化；处在表名、列名位置（FROM/JOIN/INTO/UPDATE/TABLE/BY之后或与.相连）、与其他文字相连或写在字符串中间的参数仍然内联')
+    template_tokens = models.JSONField(blank=True, null=True, editable=False, verbose_name='模板解析结果')
+    watermark_column = models.CharField(max_length=100, blank=True, default='', verbose_name='水位列', help_text='设置后按增量方式执行：SQL中用 {{ watermark }} 引用上次结果中该列的最大值，SQL需要按该列升序排序')
+    watermark_start = models.CharField(max_length=100, blank=True, default='', verbose_name='初始水位', help_text='第一次执行时 {{ watermark }} 的值')
+    watermark_value = models.JSONField(blank=True, null=True, editable=False, verbose_name='当前水位')
+    delta_storage = models.BooleanField(default=False, verbose_name='增量存储结果', help_text='只保存与上一次结果相比变化的行，读取时自动重建')
+    snapshot_every = models.PositiveIntegerField(default=10, verbose_name='完整快照间隔', help_text='增量存储时每隔多少次执行保存一次完整结果')
+    result_retention_days = models.PositiveIntegerField(default=0, verbose_name='结果保留天数', help_text='超过天数的执行结果清理结果数据，只保留状态和耗时；0表示使用全局设置')
+    summary_retention_days = models.PositiveIntegerField(default=0, verbose_name='执行记录保留天数', help_text='超过天数的执行结果整条删除；0表示使用全局设置')
+    cache_ttl = models.PositiveIntegerField(default=0, verbose_name='结果缓存时间(秒)', help_text='相同SQL在缓存时间内直接复用上次结果，0表示不缓存')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     periodic_task = models.OneToOneField(PeriodicTask, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='定时任务')
+    # 最近一次执行的冗余信息，由 ExecutionResult.save 在同一个事务里更新，列表页不需要再逐个查询执行结果
+    latest_result = models.ForeignKey('ExecutionResult', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='latest_for', verbose_name='最近执行结果')
+    last_status = models.CharField(max_length=20, blank=True, default='', editable=False, verbose_name='最近执行状态')
+    last_run_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='最近执行时间')
+    last_execution_time = models.FloatField(null=True, blank=True, editable=False, verbose_name='最近执行耗时(秒)')
+
+    LATEST_FIELDS = ('latest_result', 'last_status', 'last_run_at', 'last_execution_time')
+    # 由任务维护的字段：最近执行信息和增量查询的水位
+    TASK_OWNED_FIELDS = LATEST_FIELDS + ('watermark_value',)
 
     def __str__(self):
         return self.name
 
-    def get_rendered_sql(self):
+    def save(self, *args, **kwargs):
+        # 模板只在保存时解析一次，执行时直接使用解析结果
+        self.template_tokens = parse_template(self.sql_template)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'sql_template' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'template_tokens'}
+        elif update_fields is None and not self._state.adding:
+            # 最近执行信息和水位由任务维护，整体保存时不用内存中可能已过期的值覆盖
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.TASK_OWNED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    def get_query_timeout(self):
+        # 数据库连接上的 timeout 是建立连接的超时，不作为语句超时；没有单独设置时以任务的时间限制为准
+        return self.query_timeout or getattr(settings, 'CELERY_TASK_SOFT_TIME_LIMIT', 0) or 0
+
+    def get_template_tokens(self):
+        if self.template_tokens is None:
+            # 旧数据保存时还没有解析结果
+            self.template_tokens = parse_template(self.sql_template)
+        return self.template_tokens
+
+    def evaluate_parameters(self):
+        """计算所有参数的值，返回 {参数名: 值}"""
         import logging
         logger = logging.getLogger(__name__)
-        sql = self.sql_template
+        values = {}
         for param in self.parameters.all():
             value = param.evaluate()
             logger.info(f"参数 {param.name} 解析值: {value}, 类型: {type(value)}")
-            # 仅替换参数，不处理引号
-            sql = sql.replace(f'{{{{ {param.name} }}}}', str(value))
-            sql = sql.replace(f'{{{{{param.name}}}}}', str(value))
-        logger.info(f"渲染后的SQL: {sql}")
-        return sql
+            values.setdefault(param.name, value)
+        return values
+
+    def get_rendered_sql(self, values=None):
+        """参数值直接拼进 SQL 的文本，用于展示和记录"""
+        if values is None:
+            values = self.evaluate_parameters()
+        return render_inline(self.get_template_tokens(), values)
+
+    def get_bound_sql(self, db_type, values=None, names=None):
+        """带绑定变量的 SQL 和参数值，返回 (sql, params)；names 指定时只绑定这些参数"""
+        if values is None:
+            values = self.evaluate_parameters()
+        return render_bind(self.get_template_tokens(), values, db_type, names)
 
     class Meta:
         verbose_name = '查询实例'
@@ -108,24 +156,176 @@ class QueryInstance(models.Model):
 
 class ExecutionResult(models.Model):
     STATUS_CHOICES = (
+        ('running', '执行中'),
+        ('retrying', '等待重试'),
         ('success', '成功'),
         ('failed', '失败'),
     )
-    query_instance = models.ForeignKey(QueryInstance, on_delete=models.CASCADE, related_name='results', verbose_name='查询实例')
+    STORAGE_INLINE = 'inline'
+    STORAGE_CHUNKED = 'chunked'
+    STORAGE_FILE = 'file'
+    STORAGE_ARCHIVED = 'archived'
+    STORAGE_CHOICES = (
+        (STORAGE_INLINE, '内联'),
+        (STORAGE_CHUNKED, '分块'),
+        (STORAGE_FILE, '文件'),
+        (STORAGE_ARCHIVED, '已归档'),
+    )
+    FORMAT_DICT_ROWS = 1
+    FORMAT_COLUMNAR = 2
+    FORMAT_CHOICES = (
+        (FORMAT_DICT_ROWS, '字典行'),
+        (FORMAT_COLUMNAR, '列式'),
+    )
+    query_instance = models.ForeignKey(QueryInstance, on_delete=models.CASCADE, null=True, blank=True, related_name='results', verbose_name='查询实例')
+    # 组合查询的结果没有查询实例，两者只有一个有值
+    composite_query = models.ForeignKey('CompositeQuery', on_delete=models.CASCADE, null=True, blank=True, related_name='results', verbose_name='组合查询')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name='执行状态')
-    result_data = models.JSONField(blank=True, null=True, verbose_name='结果数据')
+    result_data = models.JSONField(blank=True, null=True, encoder=ResultJSONEncoder, decoder=ResultJSONDecoder, verbose_name='结果数据')
+    storage = models.CharField(max_length=20, choices=STORAGE_CHOICES, default=STORAGE_INLINE, verbose_name='存储方式')
+    row_count = models.PositiveIntegerField(blank=True, null=True, verbose_name='结果行数')
+    byte_size = models.BigIntegerField(blank=True, null=True, verbose_name='结果大小(字节)', help_text='所有行编码成JSON后的大小')
+    content_hash = models.CharField(max_length=64, blank=True, null=True, verbose_name='内容哈希', help_text='按顺序对每行JSON计算的SHA-256，与存储方式无关，内容相同的结果哈希相同')
+    file_path = models.CharField(max_length=255, blank=True, null=True, verbose_name='结果文件', help_text='文件存储时是结果文件，归档后是归档文件的相对路径')
+    checksum = models.CharField(max_length=64, blank=True, null=True, verbose_name='校验和(SHA-256)')
+    result_format = models.PositiveSmallIntegerField(choices=FORMAT_CHOICES, default=FORMAT_DICT_ROWS, verbose_name='结果格式')
+    columns = models.JSONField(blank=True, null=True, verbose_name='列信息')
     rendered_sql = models.TextField(blank=True, null=True, verbose_name='解析后的SQL')
+    truncated = models.BooleanField(default=False, verbose_name='结果已截断')
+    pruned = models.BooleanField(default=False, verbose_name='结果已清理', help_text='超过保留期限，结果数据已删除，只保留状态和耗时')
+    attempts = models.PositiveSmallIntegerField(default=1, verbose_name='执行次数')
+    attempt_log = models.JSONField(blank=True, null=True, verbose_name='执行记录', help_text='每次尝试的开始时间、耗时和错误信息')
+    slot_wait_time = models.FloatField(default=0, verbose_name='排队等待时间(秒)', help_text='目标库并发已满时等待执行槽的时间')
+    task_id = models.CharField(max_length=255, blank=True, null=True, editable=False, verbose_name='任务ID', help_text='正在执行这个结果的 celery 任务，取消执行时使用')
+    # 增量结果依赖基准的数据：单独删除仍被引用的基准会被拒绝，随查询实例一起删除时允许
+    base_result = models.ForeignKey('self', on_delete=models.RESTRICT, null=True, blank=True, related_name='delta_results', verbose_name='增量基准结果')
+    delta = models.JSONField(blank=True, null=True, verbose_name='增量信息', help_text='相对基准结果的行操作，为空表示完整保存')
+    watermark = models.JSONField(blank=True, null=True, verbose_name='水位', help_text='增量查询本次执行前后的水位')
+    cache_hits = models.PositiveIntegerField(default=0, verbose_name='缓存命中次数', help_text='该结果被缓存复用、没有实际执行查询的次数')
     execution_time = models.FloatField(verbose_name='执行时间(秒)')
     error_message = models.TextField(blank=True, null=True, verbose_name='错误信息')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='执行时间')
 
     def __str__(self):
-        return f"{self.query_instance.name} - {self.status} - {self.created_at}"
+        return f"{self.source_name} - {self.status} - {self.created_at}"
+
+    @property
+    def source_name(self):
+        """产生这个结果的查询实例或组合查询的名称"""
+        if self.composite_query_id:
+            return self.composite_query.name
+        return self.query_instance.name
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_latest()
+
+    def _update_latest(self):
+        """更新查询实例上的最近执行信息；只会指向更新的结果，先开始后结束的旧任务不会覆盖"""
+        if self.query_instance_id is None:
+            return
+        QueryInstance.objects.filter(
+            Q(latest_result__isnull=True) | Q(latest_result__lte=self.pk),
+            pk=self.query_instance_id,
+        ).update(
+            latest_result=self.pk,
+            last_status=self.status,
+            last_run_at=self.created_at,
+            last_execution_time=self.execution_time,
+        )
 
     class Meta:
         verbose_name = '执行结果'
         verbose_name_plural = '执行结果'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['query_instance', 'created_at']),
+        ]
+
+
+def refresh_latest_result(query_instances):
+    """按现有的执行结果重新计算最近执行信息"""
+    latest = ExecutionResult.objects.filter(query_instance=OuterRef('pk')).order_by('-created_at', '-pk')
+    return query_instances.update(
+        latest_result=Subquery(latest.values('pk')[:1]),
+        last_status=Coalesce(Subquery(latest.values('status')[:1]), Value('')),
+        last_run_at=Subquery(latest.values('created_at')[:1]),
+        last_execution_time=Subquery(latest.values('execution_time')[:1]),
+    )
+
+
+@receiver(post_delete, sender=ExecutionResult)
+def remove_result_file(sender, instance, **kwargs):
+    """删除执行结果时一并删除对应的结果文件（查询集批量删除也会触发）"""
+    if instance.storage == ExecutionResult.STORAGE_FILE:
+        remove_file(instance.file_path)
+
+
+@receiver(post_delete, sender=ExecutionResult)
+def refresh_latest_after_delete(sender, instance, **kwargs):
+    """删除的是最近执行结果时（指针已被置空），改为指向剩下的最新结果"""
+    refresh_latest_result(QueryInstance.objects.filter(pk=instance.query_instance_id, latest_result__isnull=True))
+
+
+class ExecutionResultChunk(models.Model):
+    result = models.ForeignKey(ExecutionResult, on_delete=models.CASCADE, related_name='chunks', verbose_name='执行结果')
+    sequence = models.PositiveIntegerField(verbose_name='分块序号')
+    start_row = models.PositiveIntegerField(verbose_name='起始行')
+    end_row = models.PositiveIntegerField(verbose_name='结束行(不含)')
+    payload = models.JSONField(encoder=ResultJSONEncoder, decoder=ResultJSONDecoder, verbose_name='分块数据')
+
+    def __str__(self):
+        return f"{self.result_id} - {self.sequence}"
+
+    class Meta:
+        verbose_name = '结果分块'
+        verbose_name_plural = '结果分块'
+        ordering = ['result', 'sequence']
+        unique_together = ('result', 'sequence')
+        indexes = [
+            models.Index(fields=['result', 'start_row']),
+        ]
+
+
+class CompositeQuery(models.Model):
+    """在多个查询实例的结果上执行关联、汇总的组合查询
+
+    每个来源查询的结果以别名作为表名载入本地的 SQLite，SQL 使用 SQLite 语法，
+    输出保存为普通的执行结果。
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name='名称')
+    description = models.TextField(blank=True, default='', verbose_name='描述')
+    sql = models.TextField(verbose_name='组合SQL', help_text='SQLite语法，来源查询的结果以别名作为表名，例如 SELECT * FROM a JOIN b ON a.id = b.id')
+    sources = models.ManyToManyField(QueryInstance, through='CompositeSource', related_name='composite_queries', verbose_name='来源查询')
+    refresh_sources = models.BooleanField(default=False, verbose_name='执行前刷新来源', help_text='先并行执行所有来源查询，再用新结果组合；否则使用各来源最近一次成功的结果')
+    max_rows = models.PositiveIntegerField(default=0, verbose_name='最大返回行数', help_text='超出部分将被丢弃，0表示不限制')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = '组合查询'
+        verbose_name_plural = '组合查询'
+
+
+class CompositeSource(models.Model):
+    composite_query = models.ForeignKey(CompositeQuery, on_delete=models.CASCADE, related_name='source_links', verbose_name='组合查询')
+    query_instance = models.ForeignKey(QueryInstance, on_delete=models.CASCADE, related_name='composite_links', verbose_name='查询实例')
+    alias = models.CharField(max_length=50, verbose_name='表名', validators=[
+        RegexValidator(r'^[A-Za-z_][A-Za-z0-9_]*$', '表名只能包含字母、数字和下划线，且不能以数字开头'),
+    ])
+
+    def __str__(self):
+        return f"{self.composite_query.name} - {self.alias}"
+
+    class Meta:
+        verbose_name = '组合查询来源'
+        verbose_name_plural = '组合查询来源'
+        unique_together = ('composite_query', 'alias')
 
 
 # class NotificationConfig(models.Model):
@@ -166,6 +366,8 @@ class Script(models.Model):
     review_notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     approved_at = models.DateTimeField(null=True, blank=True)
+    output_retention_days = models.PositiveIntegerField(default=0, verbose_name='输出保留天数', help_text='超过天数的执行日志清空输出内容；0表示使用全局设置')
+    log_retention_days = models.PositiveIntegerField(default=0, verbose_name='日志保留天数', help_text='超过天数的执行日志整条删除；0表示使用全局设置')
 
     def __str__(self):
         return f"{self.title}"
@@ -194,4 +396,7 @@ class ExecutionLog(models.Model):
 
     class Meta:
         verbose_name_plural = "脚本执行日志"
-        verbose_name = "脚本执行日志"
\ No newline at end of file
+        verbose_name = "脚本执行日志"
+        indexes = [
+            models.Index(fields=['executed_at']),
+        ]
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+SQL 参数的计算
+
+参数的 python_code 只编译一次，编译结果按参数 id 缓存，参数修改后（updated_at 变化）重新编译。
+计算结果在同一个时间窗口（DBQUERY_PARAMETER_MEMO_WINDOW 秒，按整点对齐）内复用：
+例如"昨天的日期"被 200 个定时查询引用时，同一分钟内只计算一次。
+"""
+import datetime
+import json
+import logging
+import math
+import re
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 参数代码可以直接使用的模块
+PARAMETER_GLOBALS = {
+    'datetime': datetime,
+    'time': time,
+    'math': math,
+    'json': json,
+    're': re,
+}
+
+_lock = threading.Lock()
+_compiled = {}   # 参数 id -> (updated_at, code)
+_memo = {}       # (参数 id, updated_at) -> 值，只保存当前窗口的
+_memo_window = None
+
+
+def get_memo_window():
+    """值复用的时间窗口(秒)，0 表示每次都重新计算"""
+    return getattr(settings, 'DBQUERY_PARAMETER_MEMO_WINDOW', 60)
+
+
+def compile_parameter(parameter):
+    """返回参数代码编译后的 code 对象，代码没有变化时直接用缓存"""
+    cached = _compiled.get(parameter.pk)
+    if cached is not None and cached[0] == parameter.updated_at:
+        return cached[1]
+    code = compile(parameter.python_code, f'<SQLParameter {parameter.name}>', 'eval')
+    with _lock:
+        _compiled[parameter.pk] = (parameter.updated_at, code)
+    return code
+
+
+def _current_window():
+    window = get_memo_window()
+    if not window:
+        return None
+    return int(time.time() // window)
+
+
+def evaluate_parameter(parameter):
+    """计算参数的值，出错时返回错误信息字符串（与原有行为一致）"""
+    global _memo_window
+    key = (parameter.pk, parameter.updated_at)
+    window = _current_window()
+    if window is not None:
+        with _lock:
+            if window != _memo_window:
+                # 进入新的窗口，丢弃上一个窗口的值
+                _memo.clear()
+                _memo_window = window
+            if key in _memo:
+                return _memo[key]
+    try:
+        # eval 会往 globals 里写 __builtins__，参数代码也可能改写其中的名字，每次使用一份副本
+        value = eval(compile_parameter(parameter), dict(PARAMETER_GLOBALS), {})
+    except Exception as e:
+        error_msg = f"Error: {str(e)}"
+        logger.error(f"参数计算错误: {error_msg}")
+        return error_msg
+    if window is not None:
+        with _lock:
+            if window == _memo_window:
+                _memo[key] = value
+    return value
+
+
+def clear_caches():
+    with _lock:
+        _compiled.clear()
+        _memo.clear()
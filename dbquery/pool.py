@@ -0,0 +1,286 @@
+"""
+目标数据库连接池
+
+每个 Celery worker 进程各自维护一组连接池，按 DatabaseConnection 的 id 和 updated_at
+区分。连接配置在后台被修改后 updated_at 会变化，worker 下次取连接时发现版本不一致，
+就会关闭旧池并按新配置重建，因此不需要跨进程通知。
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """在限定时间内没有拿到可用连接"""
+
+
+def create_connection(connection):
+    """按连接配置新建一个目标数据库连接"""
+    if connection.db_type == 'mysql':
+        import pymysql
+        return pymysql.connect(
+            host=connection.host,
+            port=connection.port,
+            user=connection.username,
+            password=connection.password,
+            database=connection.database,
+            connect_timeout=connection.timeout
+        )
+    elif connection.db_type == 'oracle':
+        import oracledb
+        dsn = oracledb.makedsn(connection.host, connection.port, service_name=connection.database)
+        return oracledb.connect(user=connection.username, password=connection.password, dsn=dsn, timeout=connection.timeout)
+    elif connection.db_type == 'postgresql':
+        import psycopg2
+        return psycopg2.connect(
+            host=connection.host,
+            port=connection.port,
+            user=connection.username,
+            password=connection.password,
+            dbname=connection.database,
+            connect_timeout=connection.timeout
+        )
+    elif connection.db_type == 'sqlserver':
+        import pyodbc
+        return pyodbc.connect(
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+            f"SERVER={connection.host},{connection.port};"
+            f"DATABASE={connection.database};"
+            f"UID={connection.username};"
+            f"PWD={connection.password};"
+            f"Connect Timeout={connection.timeout};"
+        )
+    raise ValueError(f"不支持的数据库类型: {connection.db_type}")
+
+
+def is_healthy(db_type, conn):
+    """取出连接前的健康检查，失败的连接直接丢弃"""
+    try:
+        if db_type == 'mysql':
+            conn.ping(reconnect=False)
+        elif db_type == 'oracle':
+            conn.ping()
+        elif db_type == 'postgresql':
+            if conn.closed:
+                return False
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+        else:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        return True
+    except Exception as e:
+        logger.warning(f"连接健康检查失败({db_type}): {str(e)}")
+        return False
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """单个 DatabaseConnection 的连接池，线程安全"""
+
+    def __init__(self, connection, min_size=0, max_size=4, idle_timeout=300, checkout_timeout=30):
+        self.connection = connection
+        self.key = (connection.pk, connection.updated_at)
+        self.db_type = connection.db_type
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()  # (conn, 归还时间)
+        self._size = 0        # 已打开的连接数（空闲 + 使用中）
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.health_failures = 0
+
+    def _evict_idle(self):
+        """关闭空闲超时的连接，但至少保留 min_size 个"""
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        # 队列左侧是最早归还的连接
+        while self._idle and len(self._idle) > self.min_size:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self.evictions += 1
+            _close_quietly(conn)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            conn = None
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout('连接池已关闭')
+                self._evict_idle()
+                if self._idle:
+                    # 后进先出，优先复用最近用过的连接
+                    conn, _ = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"等待连接超时（{self.checkout_timeout}秒）")
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is not None:
+                # 健康检查放在锁外面做，避免一次网络往返卡住其他线程
+                if is_healthy(self.db_type, conn):
+                    with self._cond:
+                        self.hits += 1
+                    return conn
+                _close_quietly(conn)
+                with self._cond:
+                    self._size -= 1
+                    self.health_failures += 1
+                    self._cond.notify()
+                continue
+
+            try:
+                conn = create_connection(self.connection)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.misses += 1
+            return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # 结束连接上残留的事务，避免下次复用时读到旧快照
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                _close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection_context(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # 出错后连接状态不确定，交给 release 里的 rollback 判断是否还能复用
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                _close_quietly(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'connection_id': self.key[0],
+                'size': self._size,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'health_failures': self.health_failures,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def _reset_after_fork():
+    """fork 出的子进程不能复用父进程的 socket，直接丢弃（不要 close，否则会影响父进程）"""
+    global _pools_pid
+    if _pools_pid != os.getpid():
+        _pools.clear()
+        _pools_pid = os.getpid()
+
+
+def get_pool(connection):
+    """获取（必要时创建）当前进程内该连接对应的连接池"""
+    key = (connection.pk, connection.updated_at)
+    with _pools_lock:
+        _reset_after_fork()
+        pool = _pools.get(connection.pk)
+        if pool is not None and pool.key != key:
+            logger.info(f"数据库连接 {connection.name} 配置已更新，重建连接池")
+            pool.close()
+            pool = None
+        if pool is None:
+            pool = ConnectionPool(
+                connection,
+                min_size=getattr(settings, 'DBQUERY_POOL_MIN_SIZE', 0),
+                max_size=getattr(settings, 'DBQUERY_POOL_MAX_SIZE', 4),
+                idle_timeout=getattr(settings, 'DBQUERY_POOL_IDLE_TIMEOUT', 300),
+                checkout_timeout=getattr(settings, 'DBQUERY_POOL_CHECKOUT_TIMEOUT', 30),
+            )
+            _pools[connection.pk] = pool
+        return pool
+
+
+@contextmanager
+def pooled_connection(connection):
+    """取一个目标库连接，用完自动归还；关闭连接池时每次都新建并关闭连接"""
+    if not getattr(settings, 'DBQUERY_POOL_ENABLED', True):
+        conn = create_connection(connection)
+        try:
+            yield conn
+        finally:
+            _close_quietly(conn)
+        return
+    with get_pool(connection).connection_context() as conn:
+        yield conn
+
+
+def invalidate_pool(connection_id):
+    """连接配置修改或删除后关闭对应的连接池"""
+    with _pools_lock:
+        _reset_after_fork()
+        pool = _pools.pop(connection_id, None)
+    if pool is not None:
+        pool.close()
+
+
+def pool_stats():
+    with _pools_lock:
+        _reset_after_fork()
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
@@ -0,0 +1,91 @@
+"""
+查询结果缓存
+
+同一个连接上、渲染后 SQL 相同的查询在缓存有效期内直接复用上一次的执行结果，
+不再访问目标库。缓存里只保存 ExecutionResult 的 id，结果数据仍在原来的位置。
+
+缓存未命中时通过一个锁键保证同一时刻只有一个任务真正执行查询，其余任务等待它的结果
+（single-flight），避免同时触发的大量任务一起压到目标库上。
+缓存使用 DBQUERY_CACHE_ALIAS 指定的 Django 缓存，配置了 Redis 时多个 worker 共享，
+否则退化为进程内缓存。
+"""
+import hashlib
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+
+from .models import ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache():
+    return caches[getattr(settings, 'DBQUERY_CACHE_ALIAS', 'default')]
+
+
+def cache_key(connection, sql, max_rows=0):
+    digest = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+    return f'dbquery:result:{connection.pk}:{max_rows}:{digest}'
+
+
+class ResultCache:
+    """一个 (连接, SQL) 对应的缓存项"""
+
+    def __init__(self, connection, sql, ttl, max_rows=0):
+        self.key = cache_key(connection, sql, max_rows)
+        self.lock_key = f'{self.key}:lock'
+        self.ttl = ttl
+        self.cache = get_cache()
+        self._token = None
+
+    def get(self):
+        """返回缓存的执行结果，结果已被删除、清理或不是成功状态时视为未命中"""
+        result_id = self.cache.get(self.key)
+        if result_id is None:
+            return None
+        result = ExecutionResult.objects.filter(pk=result_id, status='success', pruned=False).first()
+        if result is None:
+            self.cache.delete(self.key)
+        return result
+
+    def acquire(self, wait_timeout=None):
+        """命中缓存时返回执行结果；否则尝试成为执行者并返回 None
+
+        拿不到锁说明已有任务在执行同样的查询，轮询等待它写入缓存。
+        执行者失败（锁被释放但没有结果）时重新抢锁；等待超时则不再等待，自行执行。
+        """
+        if wait_timeout is None:
+            wait_timeout = getattr(settings, 'DBQUERY_CACHE_WAIT_TIMEOUT', 60)
+        lock_timeout = getattr(settings, 'CELERY_TASK_TIME_LIMIT', 600)
+        deadline = time.monotonic() + wait_timeout
+        interval = 0.1
+        while True:
+            result = self.get()
+            if result is not None:
+                return result
+            token = uuid.uuid4().hex
+            if self.cache.add(self.lock_key, token, timeout=lock_timeout):
+                self._token = token
+                return None
+            if time.monotonic() >= deadline:
+                logger.warning(f"等待相同查询执行超时（{wait_timeout}秒），直接执行")
+                return None
+            time.sleep(interval)
+            interval = min(interval * 2, 2)
+
+    def store(self, result):
+        self.cache.set(self.key, result.pk, timeout=self.ttl)
+
+    def release(self):
+        """只释放自己持有的锁，避免锁过期后误删别的任务的锁"""
+        if self._token is not None and self.cache.get(self.lock_key) == self._token:
+            self.cache.delete(self.lock_key)
+        self._token = None
+
+
+def record_hit(result):
+    ExecutionResult.objects.filter(pk=result.pk).update(cache_hits=F('cache_hits') + 1)
@@ -0,0 +1,205 @@
+"""
+执行结果和脚本执行日志的保留策略
+
+分两级清理：
+- 超过结果保留天数的执行结果删除结果数据（分块、结果文件），只保留状态、行数和耗时，标记为已清理；
+  脚本执行日志则清空输出内容；
+- 超过记录保留天数的整条删除。
+
+开启了归档（DBQUERY_ARCHIVE_ENABLED，见 archive.py）时，第一级改为把结果数据移到归档文件，
+数据库中只保留存根，数据仍然可以读取；删除存根不会删除归档中的数据。
+
+天数可以在每个查询实例、脚本上单独设置，0 表示使用全局设置（DBQUERY_*_RETENTION_DAYS），
+全局设置为 0 表示不清理。由定时任务 enforce_retention 执行。
+
+每次只处理 DBQUERY_RETENTION_BATCH_SIZE 条，每批是一个短事务，批次之间稍作停顿，
+不会长时间锁表，也不会让复制延迟堆积；单次运行超过 DBQUERY_RETENTION_MAX_SECONDS
+就停止，剩下的留给下一次。
+
+增量存储的结果依赖基准结果的数据，还被未清理的增量结果引用的基准不会被清理或删除；
+增量结果被清理后不再依赖基准，基准在下一批中即可处理。
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .analytics import remove_cached
+from .archive import ArchiveSession, archive_enabled
+from .filestore import remove_file
+from .models import ExecutionLog, ExecutionResult, ExecutionResultChunk, QueryInstance, Script
+
+logger = logging.getLogger(__name__)
+
+# 执行中、等待重试的结果不处理
+FINISHED_STATUSES = ('success', 'failed')
+
+
+def _policies(model, field, result_days_field, summary_days_field, default_result_days, default_summary_days):
+    """按保留天数分组，返回 [(过滤条件, 结果保留天数, 记录保留天数)]
+
+    没有单独设置的对象共用一个条件，单独设置的按天数组合归并，查询数只和不同的设置种数有关。
+    """
+    groups = defaultdict(list)
+    custom = model.objects.filter(Q(**{f'{result_days_field}__gt': 0}) | Q(**{f'{summary_days_field}__gt': 0}))
+    for pk, result_days, summary_days in custom.values_list('pk', result_days_field, summary_days_field):
+        groups[(result_days or default_result_days, summary_days or default_summary_days)].append(pk)
+    # 没有所属对象的记录（组合查询的结果）也使用全局设置
+    default_condition = (
+        Q(**{f'{field}__isnull': True})
+        | Q(**{f'{field}__{result_days_field}': 0, f'{field}__{summary_days_field}': 0})
+    )
+    policies = [(default_condition, default_result_days, default_summary_days)]
+    for (result_days, summary_days), pks in groups.items():
+        policies.append((Q(**{f'{field}_id__in': pks}), result_days, summary_days))
+    return policies
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    def passed(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+
+def _run_batches(handler, queryset, batch_size, deadline, skip=None):
+    """反复处理 queryset 的前 batch_size 条，直到没有剩余或超时，返回处理的总数
+
+    skip 是本次运行中不再选取的id集合。一批处理出错时逐条重试，出错的记录加入 skip 并跳过，
+    最旧的一条坏数据不会让之后的每次运行都卡住。
+    """
+    pause = getattr(settings, 'DBQUERY_RETENTION_BATCH_PAUSE', 0.2)
+    skip = set() if skip is None else skip
+    total = 0
+    while not deadline.passed():
+        ids = list(queryset.exclude(pk__in=skip).values_list('pk', flat=True)[:batch_size]) if skip \
+            else list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        # 不足一批也继续查一次：清理增量结果之后，它的基准才能在下一批中处理
+        try:
+            total += handler(ids)
+        except Exception as e:
+            logger.warning(f"{handler.__name__} 批量处理失败，改为逐条处理: {e}")
+            for pk in ids:
+                try:
+                    total += handler([pk])
+                except Exception as e:
+                    logger.exception(f"{handler.__name__} 处理记录 {pk} 失败，本次跳过: {e}")
+                    skip.add(pk)
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def prune_results(ids):
+    """删除结果数据，只保留执行记录"""
+    with transaction.atomic():
+        file_paths = list(
+            ExecutionResult.objects.filter(pk__in=ids, storage=ExecutionResult.STORAGE_FILE)
+            .values_list('file_path', flat=True)
+        )
+        ExecutionResultChunk.objects.filter(result_id__in=ids).delete()
+        count = ExecutionResult.objects.filter(pk__in=ids).update(
+            pruned=True,
+            result_data=None,
+            storage=ExecutionResult.STORAGE_INLINE,
+            file_path=None,
+            checksum=None,
+            base_result=None,
+            delta=None,
+        )
+    # 文件在事务提交之后再删，回滚时不会丢失数据
+    for file_path in file_paths:
+        remove_file(file_path)
+    remove_cached(ids)
+    return count
+
+
+def delete_results(ids):
+    with transaction.atomic():
+        # 逐条触发 post_delete，结果文件随之删除
+        count = ExecutionResult.objects.filter(pk__in=ids).delete()[1].get(ExecutionResult._meta.label, 0)
+    remove_cached(ids)
+    return count
+
+
+def prune_logs(ids):
+    return ExecutionLog.objects.filter(pk__in=ids).update(output=None)
+
+
+def delete_logs(ids):
+    return ExecutionLog.objects.filter(pk__in=ids).delete()[0]
+
+
+def enforce_result_retention(now, batch_size, deadline):
+    stats = {'results_archived': 0, 'results_archive_failed': 0, 'results_pruned': 0, 'results_deleted': 0}
+    policies = _policies(
+        QueryInstance, 'query_instance', 'result_retention_days', 'summary_retention_days',
+        getattr(settings, 'DBQUERY_RESULT_RETENTION_DAYS', 0),
+        getattr(settings, 'DBQUERY_SUMMARY_RETENTION_DAYS', 0),
+    )
+    finished = ExecutionResult.objects.filter(status__in=FINISHED_STATUSES).order_by('created_at')
+    for condition, result_days, summary_days in policies:
+        if result_days and archive_enabled():
+            # 归档保存完整数据，依赖它的增量结果可以从归档中读取基准，不需要等待
+            expired = (
+                finished.filter(condition, status='success', pruned=False, created_at__lt=now - timedelta(days=result_days))
+                .exclude(storage=ExecutionResult.STORAGE_ARCHIVED)
+            )
+            # 整个策略的结果写进同一组归档副本，结束时每个归档文件只替换一次
+            session = ArchiveSession()
+            try:
+                _run_batches(session.add, expired, batch_size, deadline, skip=session.processed)
+            finally:
+                stats['results_archived'] += session.close()
+            stats['results_archive_failed'] += len(session.failed)
+        elif result_days:
+            expired = (
+                finished.filter(condition, pruned=False, created_at__lt=now - timedelta(days=result_days))
+                .exclude(delta_results__pruned=False)
+            )
+            stats['results_pruned'] += _run_batches(prune_results, expired, batch_size, deadline)
+        if summary_days:
+            expired = (
+                finished.filter(condition, created_at__lt=now - timedelta(days=summary_days))
+                .exclude(delta_results__isnull=False)
+            )
+            stats['results_deleted'] += _run_batches(delete_results, expired, batch_size, deadline)
+    return stats
+
+
+def enforce_log_retention(now, batch_size, deadline):
+    stats = {'logs_pruned': 0, 'logs_deleted': 0}
+    policies = _policies(
+        Script, 'script', 'output_retention_days', 'log_retention_days',
+        getattr(settings, 'DBQUERY_LOG_OUTPUT_RETENTION_DAYS', 0),
+        getattr(settings, 'DBQUERY_LOG_RETENTION_DAYS', 0),
+    )
+    logs = ExecutionLog.objects.order_by('executed_at')
+    for condition, output_days, log_days in policies:
+        if output_days:
+            expired = logs.filter(condition, output__isnull=False, executed_at__lt=now - timedelta(days=output_days))
+            stats['logs_pruned'] += _run_batches(prune_logs, expired, batch_size, deadline)
+        if log_days:
+            expired = logs.filter(condition, executed_at__lt=now - timedelta(days=log_days))
+            stats['logs_deleted'] += _run_batches(delete_logs, expired, batch_size, deadline)
+    return stats
+
+
+def enforce_retention():
+    """按保留策略清理执行结果和脚本执行日志，返回各项处理的条数"""
+    now = timezone.now()
+    batch_size = getattr(settings, 'DBQUERY_RETENTION_BATCH_SIZE', 500)
+    deadline = Deadline(getattr(settings, 'DBQUERY_RETENTION_MAX_SECONDS', 300))
+    stats = enforce_result_retention(now, batch_size, deadline)
+    stats.update(enforce_log_retention(now, batch_size, deadline))
+    stats['finished'] = not deadline.passed()
+    logger.info(f"保留策略清理完成: {stats}")
+    return stats
@@ -0,0 +1,73 @@
+"""
+Celery 任务路由
+
+- 页面上手动触发的查询进入 dbq.interactive 队列，由单独的 worker 处理，不会排在批量任务后面；
+- 定时查询按数据库类型进入 dbq.<db_type> 队列，DatabaseConnection.queue 设置了专用队列时
+  进入该队列，慢的 Oracle 批量任务不会拖慢其他库；
+- 脚本执行进入 dbq.scripts 队列。
+
+通过 CELERY_TASK_ROUTES 接入，调用方显式指定的 queue 优先于这里的路由结果。
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE_QUEUE = 'dbq.interactive'
+SCRIPTS_QUEUE = 'dbq.scripts'
+QUEUE_PREFIX = 'dbq.'
+
+SCRIPT_TASKS = (
+    'dbquery.tasks.execute_script_task',
+    'dbquery.tasks.execute_python_code',
+)
+
+
+def connection_queue(connection):
+    """定时查询使用的队列"""
+    return connection.queue or f'{QUEUE_PREFIX}{connection.db_type}'
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    if name in SCRIPT_TASKS:
+        return {'queue': SCRIPTS_QUEUE}
+    if name == 'dbquery.tasks.execute_query':
+        from .models import QueryInstance
+        query_instance_id = args[0] if args else kwargs.get('query_instance_id')
+        try:
+            query_instance = QueryInstance.objects.select_related('connection').get(id=query_instance_id)
+        except Exception as e:
+            # 查不到时交给默认队列，由任务自己报告错误
+            logger.warning(f"查询任务路由失败({query_instance_id}): {str(e)}")
+            return None
+        return {'queue': connection_queue(query_instance.connection)}
+    return None
+
+
+def execute_interactive(query_instance):
+    """提交一次交互式执行，进入高优先级队列"""
+    from .tasks import execute_query
+    return execute_query.apply_async(args=[query_instance.id], queue=INTERACTIVE_QUEUE)
+
+
+def cancel_execution(execution_result):
+    """取消一个执行中或等待重试的查询，返回是否发出了取消
+
+    以 SIGUSR1 终止任务，worker 中抛出 SoftTimeLimitExceeded，QueryStream 随即向目标库
+    发送取消请求，任务把结果记为失败；等待重试的任务还没有运行，直接记为失败。
+    """
+    from celery import current_app
+    if execution_result.status not in ('running', 'retrying') or not execution_result.task_id:
+        return False
+    current_app.control.revoke(execution_result.task_id, terminate=True, signal='SIGUSR1')
+    if execution_result.status == 'retrying':
+        execution_result.status = 'failed'
+        execution_result.error_message = '已取消'
+        execution_result.save(update_fields=['status', 'error_message'])
+    logger.info(f"已取消执行结果 {execution_result.pk} 的任务 {execution_result.task_id}")
+    return True
+
+
+def execute_composite_interactive(composite_query):
+    """手动执行组合查询；刷新来源时，来源查询仍按各自的连接路由"""
+    from .tasks import execute_composite
+    return execute_composite.apply_async(args=[composite_query.id], queue=INTERACTIVE_QUEUE)
@@ -1,24 +1,40 @@
 from rest_framework import serializers
-from .models import DatabaseConnection, SQLParameter, QueryInstance, ExecutionResult, ExecutionLog
+from .models import (
+    CompositeQuery, CompositeSource, DatabaseConnection, SQLParameter, QueryInstance, ExecutionResult, ExecutionLog,
+)
+from .storage import get_columns, iter_result_rows, read_rows, rows_to_dicts, to_columnar
 
 
-class DatabaseConnectionSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """支持 ?fields=a,b,c 只返回指定的字段，不认识的字段名忽略"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get('fields') if request is not None else None
+        if requested:
+            wanted = {name.strip() for name in requested.split(',') if name.strip()}
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+class DatabaseConnectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = DatabaseConnection
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at')
 
 
-class SQLParameterSerializer(serializers.ModelSerializer):
+class SQLParameterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = SQLParameter
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at')
 
 
-class QueryInstanceSerializer(serializers.ModelSerializer):
+class QueryInstanceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     connection_name = serializers.ReadOnlyField(source='connection.name')
-    parameter_names = serializers.ReadOnlyField(source='get_parameter_names')
+    parameter_names = serializers.SerializerMethodField()
 
     class Meta:
         model = QueryInstance
@@ -26,11 +42,55 @@ class QueryInstanceSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at', 'updated_at')
 
     def get_parameter_names(self, obj):
+        # 列表接口预取了 parameters，这里不会逐条查询
         return [param.name for param in obj.parameters.all()]
 
 
-class ExecutionResultSerializer(serializers.ModelSerializer):
+class CompositeSourceSerializer(serializers.ModelSerializer):
     query_instance_name = serializers.ReadOnlyField(source='query_instance.name')
+
+    class Meta:
+        model = CompositeSource
+        fields = ('id', 'query_instance', 'query_instance_name', 'alias')
+
+
+class CompositeQuerySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    sources = CompositeSourceSerializer(source='source_links', many=True)
+
+    class Meta:
+        model = CompositeQuery
+        fields = '__all__'
+        read_only_fields = ('created_at', 'updated_at')
+
+    def validate_sources(self, value):
+        aliases = [item['alias'] for item in value]
+        if len(set(aliases)) != len(aliases):
+            raise serializers.ValidationError('来源的表名不能重复')
+        return value
+
+    def _save_sources(self, composite_query, sources):
+        composite_query.source_links.all().delete()
+        CompositeSource.objects.bulk_create(
+            CompositeSource(composite_query=composite_query, **item) for item in sources
+        )
+
+    def create(self, validated_data):
+        sources = validated_data.pop('source_links', [])
+        composite_query = super().create(validated_data)
+        self._save_sources(composite_query, sources)
+        return composite_query
+
+    def update(self, instance, validated_data):
+        sources = validated_data.pop('source_links', None)
+        composite_query = super().update(instance, validated_data)
+        if sources is not None:
+            self._save_sources(composite_query, sources)
+        return composite_query
+
+
+class ExecutionResultSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # 组合查询的结果没有查询实例，显示组合查询的名称
+    query_instance_name = serializers.ReadOnlyField(source='source_name')
     formatted_result_data = serializers.SerializerMethodField()
 
     class Meta:
@@ -38,11 +98,37 @@ class ExecutionResultSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('created_at',)
 
+    def to_representation(self, obj):
+        data = super().to_representation(obj)
+        if obj.storage != ExecutionResult.STORAGE_INLINE and 'result_data' in data:
+            # 分块、文件、归档存储的结果没有 result_data，数据只在 formatted_result_data 中返回一份
+            data['result_data'] = None
+        return data
+
+    def _wants_legacy_shape(self):
+        request = self.context.get('request')
+        return request is not None and request.query_params.get('shape') == 'legacy'
+
     def get_formatted_result_data(self, obj):
-        # 确保返回的数据是列表格式
-        if obj.result_data and not isinstance(obj.result_data, list):
-            return [obj.result_data]
-        return obj.result_data or []
+        """默认返回列式结果 {format, columns, rows}，?shape=legacy 时还原成字典行列表
+
+        可以通过 offset/limit 只取其中一段，分块存储时只读取涉及的分块。
+        """
+        row_slice = self.context.get('row_slice')
+        rows = read_rows(obj, *row_slice) if row_slice else list(iter_result_rows(obj))
+        if self._wants_legacy_shape():
+            return rows_to_dicts(get_columns(obj), rows)
+        return to_columnar(obj, rows)
+
+class ExecutionResultListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """列表用的轻量表示，只有行数、大小、列信息等元数据，结果数据等大字段在查询时也不会被读取"""
+    # 组合查询的结果没有查询实例，显示组合查询的名称
+    query_instance_name = serializers.ReadOnlyField(source='source_name')
+
+    class Meta:
+        model = ExecutionResult
+        exclude = ('result_data', 'rendered_sql', 'attempt_log', 'delta')
+        read_only_fields = ('created_at',)
 
 
 class PaginatedExecutionResultSerializer(serializers.Serializer):
@@ -51,7 +137,7 @@ class PaginatedExecutionResultSerializer(serializers.Serializer):
     previous = serializers.URLField(allow_null=True)
     results = ExecutionResultSerializer(many=True)
 
-class ExecutionLogSerializer(serializers.ModelSerializer):
+class ExecutionLogSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     script_title = serializers.CharField(source='script.title', read_only=True)
     triggered_by_name = serializers.CharField(source='triggered_by.username', read_only=True)
     status = serializers.SerializerMethodField()
@@ -0,0 +1,139 @@
+"""
+SQL 模板的解析与渲染
+
+sql_template 在保存时解析成一组片段（文本和参数占位符），执行时不再对整段 SQL 反复做字符串替换。
+同一组片段可以渲染成两种形式：
+
+- 内联：参数值直接拼进 SQL 文本，与原来的 str.replace 结果相同，用于展示和记录 rendered_sql；
+- 绑定：参数位置换成驱动的绑定变量（%s、:p0、?），参数值单独传给驱动，SQL 文本保持不变，
+  目标库可以复用游标和执行计划。
+
+占位符写成 {{ name }} 或 {{name}}。写在单引号里（'{{ name }}'）的占位符绑定时连同引号一起
+替换成绑定变量；紧挨着标识符的占位符（例如表名后缀 t_{{ month }}）、写在字符串中间的占位符
+（例如 '%{{ name }}%'）和处在标识符位置的占位符（FROM/JOIN/INTO/UPDATE/TABLE/BY 之后，
+或与 . 相连，例如 FROM {{ table }}、{{ schema }}.t、ORDER BY {{ column }}）不能绑定，始终内联。
+
+注意 pymysql 和 psycopg2 是在客户端把参数转义后拼进 SQL 再发送的，服务端看到的仍是字面量；
+Oracle 使用真正的服务端绑定变量。
+"""
+import re
+
+PLACEHOLDER_RE = re.compile(r'\{\{ ?([^{}]+?) ?\}\}')
+_WORD_CHAR_RE = re.compile(r'\w')
+# 占位符前面是这些关键字或 . 时，占位符是表名、列名等标识符，不是值
+_IDENTIFIER_BEFORE_RE = re.compile(r'(?:\b(?:FROM|JOIN|INTO|UPDATE|TABLE|BY)\s+|\.\s*)$', re.IGNORECASE)
+
+# 片段类型
+TEXT = 'text'
+PARAM = 'param'
+
+# 占位符的位置
+BARE = 'bare'        # 单独出现，可以直接绑定
+QUOTED = 'quoted'    # 写在单引号中，绑定时连同引号一起替换
+INLINE = 'inline'    # 与其他文本连在一起，只能内联
+
+# 数据库类型对应的绑定变量写法
+PARAMSTYLES = {
+    'mysql': 'format',
+    'postgresql': 'format',
+    'oracle': 'named',
+    'sqlserver': 'qmark',
+    'sqlite': 'qmark',
+}
+
+
+def parse_template(template):
+    """把 SQL 模板解析成片段列表 [[TEXT, 文本] | [PARAM, 参数名, 原始占位符, 位置]]"""
+    tokens = []
+    text = ''
+    position = 0
+    quotes = 0  # 占位符之前出现的单引号个数，奇数表示在字符串里
+    for match in PLACEHOLDER_RE.finditer(template):
+        before = template[position:match.start()]
+        quotes += before.count("'")
+        text += before
+        position = match.end()
+        rest = template[position:]
+        in_string = quotes % 2 == 1
+        if in_string and text.endswith("'") and rest.startswith("'") and not rest.startswith("''"):
+            # 整个字符串就是这个占位符
+            kind = QUOTED
+            text = text[:-1]
+            position += 1
+            quotes += 1
+        elif in_string or (text and _WORD_CHAR_RE.match(text[-1])) or (rest and _WORD_CHAR_RE.match(rest[0])):
+            kind = INLINE
+        elif _IDENTIFIER_BEFORE_RE.search(text) or rest.lstrip().startswith('.'):
+            kind = INLINE
+        else:
+            kind = BARE
+        if text:
+            tokens.append([TEXT, text])
+            text = ''
+        tokens.append([PARAM, match.group(1), match.group(0), kind])
+    text += template[position:]
+    if text:
+        tokens.append([TEXT, text])
+    return tokens
+
+
+def _inline(token, value):
+    _, _, _, kind = token
+    if kind == QUOTED:
+        return f"'{value}'"
+    return str(value)
+
+
+def render_inline(tokens, values):
+    """参数值直接拼进 SQL；values 中没有的参数保留原始占位符"""
+    parts = []
+    for token in tokens:
+        if token[0] == TEXT:
+            parts.append(token[1])
+        elif token[1] in values:
+            parts.append(_inline(token, values[token[1]]))
+        else:
+            parts.append(f"'{token[2]}'" if token[3] == QUOTED else token[2])
+    return ''.join(parts)
+
+
+def render_bind(tokens, values, db_type, names=None):
+    """渲染成带绑定变量的 SQL，返回 (sql, params)
+
+    named 写法时 params 是字典，其他写法是列表。列表或元组类型的值展开成多个绑定变量，
+    可以直接用在 IN (...) 中。names 不为空时只绑定其中的参数，其余参数内联。
+    """
+    style = PARAMSTYLES.get(db_type, 'qmark')
+    params = {} if style == 'named' else []
+    parts = []
+
+    def placeholder(value):
+        if style == 'named':
+            name = f'p{len(params)}'
+            params[name] = value
+            return f':{name}'
+        params.append(value)
+        return '%s' if style == 'format' else '?'
+
+    for token in tokens:
+        if token[0] == TEXT:
+            text = token[1]
+            # format 写法下驱动会对整段 SQL 做 % 格式化，文本中的 % 需要转义
+            parts.append(text.replace('%', '%%') if style == 'format' else text)
+            continue
+        name, raw, kind = token[1], token[2], token[3]
+        if name not in values:
+            text = f"'{raw}'" if kind == QUOTED else raw
+            parts.append(text.replace('%', '%%') if style == 'format' else text)
+        elif kind == INLINE or (names is not None and name not in names):
+            text = _inline(token, values[name])
+            parts.append(text.replace('%', '%%') if style == 'format' else text)
+        elif kind == QUOTED:
+            parts.append(placeholder(str(values[name])))
+        elif isinstance(values[name], (list, tuple)):
+            if not values[name]:
+                raise ValueError(f'参数 {name} 是空列表，无法展开成绑定变量（IN () 不是合法的 SQL）')
+            parts.append(', '.join(placeholder(item) for item in values[name]))
+        else:
+            parts.append(placeholder(values[name]))
+    return ''.join(parts), params
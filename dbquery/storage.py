@@ -0,0 +1,344 @@
+"""
+查询结果的持久化与读取
+
+新的执行结果按固定行数切分成 ExecutionResultChunk 分块存储，worker 边读边写；
+旧记录仍然是 ExecutionResult.result_data 中的一整段 JSON。读取时统一走这里的函数，
+按需只加载涉及到的分块。
+
+超过 DBQUERY_RESULT_FILE_THRESHOLD 的结果写入磁盘上的结果文件（见 filestore），
+读取时通过 mmap 按行定位，不经过数据库。
+开启增量存储的查询只保存与上一次结果相比新增的行和行的排列（见 delta），读取时自动重建。
+
+新结果使用列式格式（ExecutionResult.FORMAT_COLUMNAR）：列名和类型只记录一次，
+每行是一个数组。读取函数返回的行统一是与 get_columns 对齐的列表，
+需要旧的字典格式时再用 rows_to_dicts 转换。
+"""
+import hashlib
+import heapq
+import json
+from itertools import islice
+
+from django.conf import settings
+
+from .encoders import build_row_converter, encode_row, encode_rows
+from .filestore import ResultFile, ResultFileWriter, get_file_threshold, relative_path_for
+from .models import ExecutionResult, ExecutionResultChunk
+
+
+def get_chunk_size():
+    return getattr(settings, 'DBQUERY_RESULT_CHUNK_SIZE', 1000)
+
+
+class ResultWriter:
+    """按批写入查询结果
+
+    行先攒到一个分块大小，满了就生成一个分块对象；
+    攒够 flush_every 个分块后用 bulk_create 一次写入数据库。
+    写入前按列类型转换成 JSON 原生类型，转换函数在收到列信息时只生成一次；
+    每行只编码一次，分块直接保存编码好的文本。
+
+    开启文件存储时，编码后的结果超过阈值就把已经写入数据库的分块读回来，连同后续的行
+    全部写到结果文件，再删除这些分块。内存中最多保留 flush_every 个分块。
+    """
+
+    def __init__(self, result, chunk_size=None, flush_every=None, file_threshold=None):
+        self.result = result
+        self.chunk_size = chunk_size or get_chunk_size()
+        self.flush_every = flush_every or getattr(settings, 'DBQUERY_RESULT_FLUSH_CHUNKS', 10)
+        self.file_threshold = get_file_threshold() if file_threshold is None else file_threshold
+        self.row_count = 0
+        self.byte_size = 0  # 实际保存的编码后大小，用于判断是否转存文件
+        self.content_size = 0  # 整个结果编码后的大小
+        self._content_hash = hashlib.sha256()
+        self._rows = []
+        self._pending = []  # 尚未写入的分块，每个分块是编码好的行列表
+        self._sequence = 0
+        self._convert = None
+        self._file = None
+
+    @property
+    def total_rows(self):
+        """结果的总行数（增量存储时与实际保存的行数不同）"""
+        return self.row_count
+
+    def write_batch(self, rows, columns=None):
+        if self._convert is None:
+            self._convert = build_row_converter(columns or [])
+        convert = self._convert
+        content_hash = self._content_hash
+        for row in rows:
+            encoded = encode_row(convert(row))
+            self.content_size += len(encoded)
+            content_hash.update(encoded)
+            content_hash.update(b'\n')
+            self._append(encoded)
+        if self._file is None and self.file_threshold and self.byte_size > self.file_threshold:
+            self._spill_to_file()
+
+    def _append(self, encoded):
+        """保存一行编码好的数据"""
+        self.byte_size += len(encoded)
+        if self._file is not None:
+            self._file.write_row(encoded)
+            self.row_count += 1
+            return
+        self._rows.append(encoded)
+        if len(self._rows) >= self.chunk_size:
+            self._cut_chunk()
+
+    def _cut_chunk(self):
+        if not self._rows:
+            return
+        self._pending.append(self._rows)
+        self._rows = []
+        if len(self._pending) >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        chunks = []
+        for rows in self._pending:
+            start_row = self.row_count
+            self.row_count += len(rows)
+            chunks.append(ExecutionResultChunk(
+                result=self.result,
+                sequence=self._sequence,
+                start_row=start_row,
+                end_row=self.row_count,
+                payload=encode_rows(rows),
+            ))
+            self._sequence += 1
+        ExecutionResultChunk.objects.bulk_create(chunks, batch_size=self.flush_every)
+        self._pending = []
+
+    def _spill_to_file(self):
+        self._file = ResultFileWriter(relative_path_for(self.result))
+        # 已经写入的分块按顺序读回写到文件（不超过阈值大小），row_count 中已包含这些行
+        flushed = self.result.chunks.order_by('sequence').values_list('payload', flat=True)
+        for payload in flushed.iterator():
+            for row in payload:
+                self._file.write_row(encode_row(row))
+        self.result.chunks.all().delete()
+        for rows in self._pending + [self._rows]:
+            for encoded in rows:
+                self._file.write_row(encoded)
+            self.row_count += len(rows)
+        self._pending = []
+        self._rows = []
+
+    def close(self):
+        """写入剩余的行，返回总行数
+
+        结果大小和内容哈希记到 result 上；写入文件时还会记下文件路径和校验和。
+        """
+        self.result.byte_size = self.content_size
+        self.result.content_hash = self._content_hash.hexdigest()
+        if self._file is not None:
+            _, checksum, _ = self._file.close()
+            self.result.storage = ExecutionResult.STORAGE_FILE
+            self.result.file_path = self._file.relative_path
+            self.result.checksum = checksum
+            return self.row_count
+        self._cut_chunk()
+        self._flush()
+        return self.row_count
+
+    def discard(self):
+        """执行失败时丢弃已写入的分块或结果文件"""
+        self._rows = []
+        self._pending = []
+        if self._file is not None:
+            self._file.discard()
+            self._file = None
+        self.result.chunks.all().delete()
+
+
+def load_inline_data(result):
+    """读取整段存放在 result_data 中的结果，返回 (列信息, 行)
+
+    result_data 可能是三种形态：
+    - 列式格式 {'format': 2, 'columns': [...], 'rows': [[...], ...]}
+    - 旧格式的字典行列表
+    - 旧版本先 json.dumps 再存进 JSONField 的字符串
+    """
+    cached = getattr(result, '_inline_data', None)
+    if cached is not None:
+        return cached
+    data = result.result_data
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except Exception:
+            data = [{'原始数据': data}]
+    if isinstance(data, dict) and data.get('format') == ExecutionResult.FORMAT_COLUMNAR:
+        columns, rows = data.get('columns') or [], data.get('rows') or []
+    else:
+        if data is None:
+            data = []
+        elif not isinstance(data, list):
+            data = [data]
+        # 旧数据每行的字段可能不一致，合并所有行的字段作为列
+        field_set = set()
+        for item in data:
+            if isinstance(item, dict):
+                field_set.update(item.keys())
+        columns = [{'name': name, 'type': 'unknown'} for name in sorted(field_set)]
+        rows = _dicts_to_rows(data, [column['name'] for column in columns])
+    result._inline_data = (columns, rows)
+    return result._inline_data
+
+
+def _dicts_to_rows(items, names):
+    return [[item.get(name) for name in names] if isinstance(item, dict) else [str(item)] for item in items]
+
+
+def rows_to_dicts(names, rows):
+    """把行数组还原成旧的字典格式，只在客户端要求时使用"""
+    return [dict(zip(names, row)) for row in rows]
+
+
+def _iter_chunk_payloads(result, window=10):
+    """按序号分段加载分块，每次只取 window 个，避免一次把所有分块读进内存"""
+    sequence = 0
+    while True:
+        payloads = list(
+            result.chunks.filter(sequence__gte=sequence, sequence__lt=sequence + window)
+            .order_by('sequence')
+            .values_list('payload', flat=True)
+        )
+        if not payloads:
+            return
+        yield from payloads
+        sequence += window
+
+
+def get_column_meta(result):
+    """结果的列信息 [{'name': 列名, 'type': 类型}]"""
+    if result.storage == ExecutionResult.STORAGE_INLINE:
+        return load_inline_data(result)[0]
+    if result.result_format == ExecutionResult.FORMAT_COLUMNAR:
+        return result.columns or []
+    # 分块存储的字典行，取第一行的键即可
+    first = result.chunks.order_by('sequence').values_list('payload', flat=True).first()
+    if first and isinstance(first[0], dict):
+        return [{'name': name, 'type': 'unknown'} for name in first[0].keys()]
+    return []
+
+
+def get_columns(result):
+    return [column['name'] for column in get_column_meta(result)]
+
+
+def _chunk_rows(result, payload, names):
+    if result.result_format == ExecutionResult.FORMAT_COLUMNAR:
+        return payload
+    return _dicts_to_rows(payload, names)
+
+
+def iter_result_rows(result):
+    """逐行遍历一个执行结果，每行是与 get_columns 对齐的列表"""
+    if result.delta:
+        from .delta import iter_delta_rows
+        yield from iter_delta_rows(result)
+        return
+    yield from iter_stored_rows(result)
+
+
+def iter_stored_rows(result):
+    """逐行遍历结果实际保存的行；增量存储的结果只保存了新增的行"""
+    if result.storage == ExecutionResult.STORAGE_INLINE:
+        yield from load_inline_data(result)[1]
+        return
+    if result.storage == ExecutionResult.STORAGE_FILE:
+        with ResultFile(result.file_path) as result_file:
+            yield from result_file.iter_rows()
+        return
+    if result.storage == ExecutionResult.STORAGE_ARCHIVED:
+        from .archive import iter_archived_rows
+        yield from iter_archived_rows(result)
+        return
+    names = get_columns(result)
+    for payload in _iter_chunk_payloads(result):
+        yield from _chunk_rows(result, payload, names)
+
+
+def read_rows(result, offset=0, limit=None):
+    """读取 [offset, offset + limit) 范围内的行
+
+    分块存储时只加载覆盖这个范围的分块，文件存储时通过稀疏索引直接定位到 offset。
+    增量存储的结果需要先重建、归档的结果需要从头解压，再取其中的一段。
+    """
+    if result.delta or result.storage == ExecutionResult.STORAGE_ARCHIVED:
+        rows = iter_result_rows(result)
+        return list(islice(rows, offset, offset + limit if limit is not None else None))
+    if result.storage == ExecutionResult.STORAGE_INLINE:
+        rows = load_inline_data(result)[1]
+        return rows[offset:offset + limit] if limit is not None else rows[offset:]
+    if result.storage == ExecutionResult.STORAGE_FILE:
+        with ResultFile(result.file_path) as result_file:
+            return list(result_file.iter_rows(offset, limit))
+
+    names = get_columns(result)
+    chunks = result.chunks.filter(end_row__gt=offset)
+    if limit is not None:
+        chunks = chunks.filter(start_row__lt=offset + limit)
+    rows = []
+    for chunk in chunks.order_by('sequence'):
+        lo = max(offset - chunk.start_row, 0)
+        hi = None if limit is None else offset + limit - chunk.start_row
+        rows.extend(_chunk_rows(result, chunk.payload[lo:hi], names))
+    return rows
+
+
+def _sort_key(index, descending, as_text=False):
+    # 空值总是排在最后；类型混杂无法比较时按文本比较
+    def key(row):
+        value = row[index]
+        if as_text and value is not None:
+            value = str(value)
+        return (value is not None, value) if descending else (value is None, value)
+    return key
+
+
+def read_sorted_rows(result, index, descending=False, offset=0, limit=None):
+    """按第 index 列排序后读取 [offset, offset + limit) 范围内的行
+
+    需要遍历全部行，但只在堆中保留前 offset + limit 行，不会把整个结果排序或读进内存。
+    """
+    if limit is None:
+        rows = list(iter_result_rows(result))
+        try:
+            rows.sort(key=_sort_key(index, descending), reverse=descending)
+        except TypeError:
+            rows.sort(key=_sort_key(index, descending, as_text=True), reverse=descending)
+        return rows[offset:]
+    select = heapq.nlargest if descending else heapq.nsmallest
+    try:
+        rows = select(offset + limit, iter_result_rows(result), key=_sort_key(index, descending))
+    except TypeError:
+        rows = select(offset + limit, iter_result_rows(result), key=_sort_key(index, descending, as_text=True))
+    return rows[offset:]
+
+
+def to_columnar(result, rows):
+    """列式的结果表示：列信息只出现一次，每行是一个数组"""
+    return {
+        'format': ExecutionResult.FORMAT_COLUMNAR,
+        'columns': get_column_meta(result),
+        'rows': rows,
+    }
+
+
+def count_rows(result):
+    if result.row_count is not None:
+        return result.row_count
+    return len(load_inline_data(result)[1])
+
+
+def has_rows(result):
+    if result.status != 'success':
+        return False
+    if result.storage != ExecutionResult.STORAGE_INLINE:
+        return bool(result.row_count)
+    return bool(result.result_data)
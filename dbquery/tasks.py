@@ -1,146 +1,233 @@
 import subprocess
 import tempfile
 import os
-from celery import shared_task
+from celery import chord, group, shared_task
+from celery.exceptions import Retry
 from django.utils import timezone
 
-from .models import QueryInstance, ExecutionResult
+from .models import CompositeQuery, QueryInstance, ExecutionResult
+from .delta import DeltaResultWriter, choose_base
+from .errors import TRANSIENT, classify_error, retry_countdown
+from .executor import QueryStream, limit_sql
+from .incremental import WATERMARK_PARAM, WatermarkTracker, current_watermark, save_with_watermark
+from .limiter import ConcurrencyLimiter, requeue_countdown
+from .pool import pooled_connection, pool_stats
+from .resultcache import ResultCache, record_hit
+from .storage import ResultWriter
 import time
-import json
 import logging
-import pymysql
-import oracledb
-from datetime import datetime
 from django.core.mail import send_mail
 from django.conf import settings
 # from .notification import NotificationService
-# 自定义JSON编码器，处理datetime对象
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
-        return super().default(obj)
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True, max_retries=3)  # 允许重试3次
-def execute_query(self, query_instance_id):
+def _attempt_entry(task, started_at, execution_time, error_message=None, error_type=None):
+    """一次执行尝试的记录"""
+    return {
+        'attempt': task.request.retries + 1,
+        'started_at': timezone.localtime(started_at).isoformat(timespec='seconds'),
+        'execution_time': round(execution_time, 3),
+        'error': error_message,
+        'error_type': error_type,
+    }
+
+
+@shared_task(bind=True, max_retries=3)  # 临时错误最多重试3次
+def execute_query(self, query_instance_id, execution_result_id=None, slot_wait_since=None):
+    """执行查询实例
+
+    只有临时错误（网络、死锁、连接数已满等）才会重试，重试沿用同一个 ExecutionResult，
+    每次尝试记录在 attempt_log 中；永久错误直接失败。
+    目标库并发已满时任务重新排队，slot_wait_since 记录第一次排队的时间。
+    """
+    result_cache = None
+    limiter = None
     try:
         start_time = time.time()
+        started_at = timezone.now()
         query_instance = QueryInstance.objects.get(id=query_instance_id)
         connection = query_instance.connection
 
         logger.info(f"开始执行查询: {query_instance.name} (ID: {query_instance_id})")
 
         # 渲染SQL
-        sql = query_instance.get_rendered_sql()
+        values = query_instance.evaluate_parameters()
+        watermark_from = None
+        if query_instance.watermark_column:
+            # 增量查询：上次结果的最大值作为 {{ watermark }} 参数
+            watermark_from = query_instance.watermark_value or {'value': query_instance.watermark_start, 'type': None}
+            values[WATERMARK_PARAM] = current_watermark(query_instance)
+        sql = query_instance.get_rendered_sql(values)
         logger.info(f"渲染后的SQL: {sql}")
+        # 使用绑定变量时执行的SQL文本固定不变，参数值单独传给驱动
+        if query_instance.use_bind_params:
+            exec_sql, exec_params = query_instance.get_bound_sql(connection.db_type, values)
+        elif query_instance.watermark_column:
+            # 水位总是以绑定变量传入，其余参数保持内联
+            exec_sql, exec_params = query_instance.get_bound_sql(connection.db_type, values, names={WATERMARK_PARAM})
+        else:
+            exec_sql, exec_params = sql, None
+        if query_instance.push_down_limit and query_instance.max_rows:
+            # 多取一行，用来判断结果是否被截断
+            exec_sql = limit_sql(exec_sql, connection.db_type, query_instance.max_rows + 1)
+
+        # 结果缓存：相同连接和SQL在有效期内直接复用上一次的结果，
+        # 同一时刻只有一个任务真正执行，其余任务等待它的结果。重试时不再等待，只写入缓存
+        if query_instance.cache_ttl:
+            result_cache = ResultCache(connection, sql, query_instance.cache_ttl, query_instance.max_rows)
+            cached_result = result_cache.acquire() if execution_result_id is None else None
+            if cached_result is not None:
+                record_hit(cached_result)
+                logger.info(f"查询命中缓存: {query_instance.name}, 复用执行结果 {cached_result.id}")
+                return {
+                    'status': 'success',
+                    'execution_time': time.time() - start_time,
+                    'result_count': cached_result.row_count,
+                    'cached_result_id': cached_result.id,
+                }
+
+        # 限制同一目标库同时执行的查询数，拿不到执行槽时稍后重新排队，不在worker里等待
+        limiter = ConcurrencyLimiter(connection)
+        if not limiter.acquire():
+            if result_cache is not None:
+                result_cache.release()
+            countdown = requeue_countdown()
+            logger.info(f"数据库连接 {connection.name} 并发已满({limiter.limit})，{countdown:.1f}秒后重新排队")
+            # 沿用原来的队列，交互式执行重新排队后仍在交互队列
+            delivery_info = self.request.delivery_info or {}
+            self.apply_async(
+                args=[query_instance_id],
+                kwargs={'execution_result_id': execution_result_id, 'slot_wait_since': slot_wait_since or start_time},
+                countdown=countdown,
+                retries=self.request.retries,
+                queue=delivery_info.get('routing_key'),
+            )
+            return {'status': 'requeued', 'execution_time': time.time() - start_time}
+        slot_wait_time = time.time() - slot_wait_since if slot_wait_since else 0
+
+        if execution_result_id is None:
+            # 先创建执行结果记录，结果分块边读边写入
+            execution_result = ExecutionResult.objects.create(
+                query_instance=query_instance,
+                status='running',
+                storage=ExecutionResult.STORAGE_CHUNKED,
+                result_format=ExecutionResult.FORMAT_COLUMNAR,
+                rendered_sql=sql,
+                execution_time=0,
+                slot_wait_time=slot_wait_time,
+                task_id=self.request.id,
+            )
+        else:
+            # 重试时沿用第一次创建的执行结果
+            execution_result = ExecutionResult.objects.get(id=execution_result_id)
+            execution_result.status = 'running'
+            execution_result.rendered_sql = sql
+            execution_result.attempts = self.request.retries + 1
+            execution_result.slot_wait_time += slot_wait_time
+            execution_result.task_id = self.request.id
+            execution_result.save(update_fields=['status', 'rendered_sql', 'attempts', 'slot_wait_time', 'task_id'])
 
         # 连接数据库并执行查询
-        result_data = None
+        # 开启增量存储时与上一次结果比较，只保存变化的行
+        base_result = choose_base(query_instance)
+        if base_result is not None:
+            writer = DeltaResultWriter(execution_result, base_result)
+        else:
+            writer = ResultWriter(execution_result)
+        watermark = WatermarkTracker(query_instance.watermark_column) if query_instance.watermark_column else None
+        truncated = False
+        columns = []
         error_message = None
         status = 'success'
 
         try:
-            if connection.db_type == 'mysql':
-                conn = pymysql.connect(
-                    host=connection.host,
-                    port=connection.port,
-                    user=connection.username,
-                    password=connection.password,
-                    database=connection.database,
-                    connect_timeout=connection.timeout
-                )
-                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
-                    cursor.execute(sql)
-                    result_data = cursor.fetchmany(1000)
-                conn.close()
-            elif connection.db_type == 'oracle':
-                dsn = oracledb.makedsn(connection.host, connection.port, service_name=connection.database)
-                conn = oracledb.connect(user=connection.username, password=connection.password, dsn=dsn, timeout=connection.timeout)
-                with conn.cursor() as cursor:
-                    cursor.execute(sql)
-                    columns = [col[0] for col in cursor.description]
-                    result_data = [dict(zip(columns, row)) for row in cursor.fetchmany(1000)]
-                conn.close()
-            # postgresql 数据库,使用 psycopg2 库
-            elif connection.db_type == 'postgresql':
-                import psycopg2
-                from psycopg2.extras import RealDictCursor
-            
-                conn = psycopg2.connect(
-                    host=connection.host,
-                    port=connection.port,
-                    user=connection.username,
-                    password=connection.password,
-                    dbname=connection.database,
-                    connect_timeout=connection.timeout
-                )
-                with conn.cursor(cursor_factory=RealDictCursor) as cursor:  # 使用RealDictCursor直接返回字典
-                    cursor.execute(sql)
-                    result_data = cursor.fetchmany(1000)
-                conn.close()
-            elif connection.db_type == 'sqlserver':
-                import pyodbc
-                conn = pyodbc.connect(
-                    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                    f"SERVER={connection.host},{connection.port};"
-                    f"DATABASE={connection.database};"
-                    f"UID={connection.username};"
-                    f"PWD={connection.password};"
-                    f"Connect Timeout={connection.timeout};"
-                )
-                with conn.cursor() as cursor:
-                    cursor.execute(sql)
-                    columns = [col[0] for col in cursor.description]
-                    result_data = [dict(zip(columns, row)) for row in cursor.fetchmany(1000)]
-                conn.close()
-
-            else:
-                raise ValueError(f"不支持的数据库类型: {connection.db_type}")
+            # 从当前worker进程的连接池中获取连接，用完归还
+            with pooled_connection(connection) as conn:
+                with QueryStream(conn, connection.db_type,
+                                 stream=query_instance.stream_results,
+                                 max_rows=query_instance.max_rows,
+                                 timeout=query_instance.get_query_timeout(),
+                                 connection=connection) as stream:
+                    stream.execute(exec_sql, exec_params)
+                    # 分批读取并写入分块，不在内存中保留整个结果集
+                    for batch in stream.batches():
+                        if watermark is not None:
+                            watermark.update(batch, stream.columns)
+                        writer.write_batch(batch, stream.columns)
+                    truncated = stream.truncated
+                    columns = stream.columns
+            writer.close()
 
         except Exception as e:
             status = 'failed'
             error_message = str(e)
-            logger.error(f"查询执行失败: {error_message}")
-            
+            error_type = classify_error(e, connection.db_type)
+            logger.error(f"查询执行失败({error_type}): {error_message}")
+            writer.discard()
+
             # 计算执行时间
             execution_time = time.time() - start_time
-            
-            # 先保存失败结果
-            ExecutionResult.objects.create(
-                query_instance=query_instance,
-                status=status,
-                result_data=None,
-                rendered_sql=sql,
-                execution_time=execution_time,
-                error_message=error_message
-            )
-            
+            will_retry = error_type == TRANSIENT and self.request.retries < self.max_retries
+
+            # 保存这次尝试的结果
+            execution_result.status = 'retrying' if will_retry else status
+            execution_result.row_count = None
+            execution_result.execution_time = execution_time
+            execution_result.error_message = error_message
+            execution_result.attempt_log = (execution_result.attempt_log or []) + [
+                _attempt_entry(self, started_at, execution_time, error_message, error_type)
+            ]
+            execution_result.save(update_fields=['status', 'row_count', 'execution_time', 'error_message', 'attempt_log'])
+
             logger.info(f"查询执行完成: {query_instance.name}, 状态: {status}, 耗时: {execution_time:.2f}秒")
-            
-            # 再进行重试
-            self.retry(exc=e, countdown=60 * (self.request.retries + 1))  # 指数退避重试
-
-        # 计算执行时间
-        execution_time = time.time() - start_time
-
-        # 保存执行结果
-        # 序列化结果数据，处理datetime对象
-        serialized_data = json.dumps(result_data, cls=DateTimeEncoder) if status == 'success' else None
-        
-        ExecutionResult.objects.create(
-            query_instance=query_instance,
-            status=status,
-            result_data=serialized_data,
-            rendered_sql=sql,
-            execution_time=execution_time,
-            error_message=error_message
-        )
+            limiter.release()
+            if result_cache is not None:
+                result_cache.release()
+
+            if will_retry:
+                countdown = retry_countdown(self.request.retries)
+                logger.info(f"临时错误，{countdown:.0f}秒后第{self.request.retries + 1}次重试")
+                raise self.retry(
+                    exc=e,
+                    countdown=countdown,
+                    args=[query_instance_id],
+                    kwargs={'execution_result_id': execution_result.id},
+                )
+        else:
+            # 计算执行时间
+            execution_time = time.time() - start_time
 
-        logger.info(f"查询执行完成: {query_instance.name}, 状态: {status}, 耗时: {execution_time:.2f}秒")
+            # 保存执行结果
+            execution_result.status = status
+            execution_result.row_count = writer.total_rows
+            execution_result.truncated = truncated
+            execution_result.columns = columns
+            execution_result.execution_time = execution_time
+            execution_result.error_message = None
+            execution_result.attempt_log = (execution_result.attempt_log or []) + [
+                _attempt_entry(self, started_at, execution_time)
+            ]
+            # writer.close() 已经设置了 byte_size、content_hash，大结果写入文件时还有 storage、file_path、checksum
+            update_fields = ['status', 'row_count', 'byte_size', 'content_hash', 'truncated', 'columns',
+                             'execution_time', 'error_message', 'attempt_log', 'storage', 'file_path',
+                             'checksum', 'base_result', 'delta']
+            if watermark is not None:
+                # 水位与执行结果在同一个事务中更新，没有新数据时保持原水位
+                watermark_to = watermark.state() or watermark_from
+                execution_result.watermark = {'from': watermark_from, 'to': watermark_to}
+                save_with_watermark(execution_result, update_fields + ['watermark'], query_instance, watermark.state())
+            else:
+                execution_result.save(update_fields=update_fields)
+            limiter.release()
+            if result_cache is not None:
+                result_cache.store(execution_result)
+                result_cache.release()
+
+            logger.info(f"查询执行完成: {query_instance.name}, 状态: {status}, 耗时: {execution_time:.2f}秒")
+            logger.info(f"连接池状态: {pool_stats()}")
 
         # 发送邮件通知
         if settings.EMAIL_HOST_USER:
@@ -159,17 +246,83 @@ def execute_query(self, query_instance_id):
         return {
             'status': status,
             'execution_time': execution_time,
-            'result_count': len(result_data) if result_data else 0
+            'result_count': writer.total_rows,
+            'execution_result_id': execution_result.id,
         }
 
+    except Retry:
+        raise
     except QueryInstance.DoesNotExist:
         logger.error(f"查询实例不存在: {query_instance_id}")
         return {'status': 'failed', 'error': '查询实例不存在'}
     except Exception as e:
         logger.error(f"任务执行异常: {str(e)}")
+        if limiter is not None:
+            limiter.release()
+        if result_cache is not None:
+            result_cache.release()
         return {'status': 'failed', 'error': str(e)}
 
 
+@shared_task
+def execute_composite(composite_query_id):
+    """执行组合查询
+
+    设置了 refresh_sources 时先并行执行所有来源查询，全部完成后由 run_composite 组合，
+    chord 依赖结果后端（Redis）；否则直接使用各来源最近一次成功的结果。
+    """
+    from .composite import run_composite as run
+    composite_query = CompositeQuery.objects.get(id=composite_query_id)
+    links = list(composite_query.source_links.order_by('pk'))
+    if composite_query.refresh_sources and links:
+        aliases = [link.alias for link in links]
+        chord(group(execute_query.si(link.query_instance_id) for link in links))(
+            run_composite.s(composite_query_id, aliases)
+        )
+        logger.info(f"组合查询 {composite_query.name} 已提交 {len(links)} 个来源查询")
+        return {'status': 'dispatched'}
+    execution_result = run(composite_query)
+    return {
+        'status': execution_result.status,
+        'execution_time': execution_result.execution_time,
+        'result_count': execution_result.row_count,
+        'execution_result_id': execution_result.id,
+    }
+
+
+@shared_task
+def run_composite(source_results, composite_query_id, aliases):
+    """来源查询全部完成后执行组合，source_results 与 aliases 一一对应"""
+    from .composite import run_composite as run
+    fresh = {}
+    errors = {}
+    for alias, source in zip(aliases, source_results):
+        source = source or {}
+        result_id = source.get('execution_result_id') or source.get('cached_result_id')
+        if source.get('status') == 'success' and result_id:
+            fresh[alias] = result_id
+        elif source.get('status') == 'requeued':
+            # 重新排队的任务不在这次 chord 里，拿不到它的结果
+            errors[alias] = '目标库并发已满，来源查询已重新排队'
+        else:
+            errors[alias] = source.get('error') or (f'见执行结果 {result_id}' if result_id else '未知错误')
+    composite_query = CompositeQuery.objects.get(id=composite_query_id)
+    execution_result = run(composite_query, fresh=fresh, source_errors=errors)
+    return {
+        'status': execution_result.status,
+        'execution_time': execution_result.execution_time,
+        'result_count': execution_result.row_count,
+        'execution_result_id': execution_result.id,
+    }
+
+
+@shared_task
+def enforce_retention():
+    """按保留策略清理过期的执行结果和脚本执行日志，由 CELERY_BEAT_SCHEDULE 每天执行"""
+    from .retention import enforce_retention as run
+    return run()
+
+
 @shared_task
 def execute_script_task(script_id):
     from .models import Script
@@ -0,0 +1,19 @@
+import decimal
+
+from django.test import SimpleTestCase, override_settings
+
+from .encoders import _convert_decimal, decode_row, encode_row
+
+
+class ConvertDecimalTests(SimpleTestCase):
+    def test_integral_value_in_int64_range(self):
+        self.assertEqual(_convert_decimal(decimal.Decimal('9223372036854775807')), 9223372036854775807)
+
+    def test_integral_value_outside_int64_range_is_string(self):
+        self.assertEqual(_convert_decimal(decimal.Decimal('123456789012345678901234')), '123456789012345678901234')
+
+    @override_settings(DBQUERY_JSON_BACKEND='orjson')
+    def test_encode_row_with_large_integral_decimal(self):
+        # orjson 不能编码超过 64 位的整数
+        data = encode_row([decimal.Decimal('123456789012345678901234'), decimal.Decimal('42')])
+        self.assertEqual(decode_row(data), ['123456789012345678901234', 42])
@@ -0,0 +1,21 @@
+from django.test import SimpleTestCase
+from psycopg2 import OperationalError
+
+from .errors import PERMANENT, TRANSIENT, classify_error
+
+
+class PostgresqlConnectErrorTests(SimpleTestCase):
+    def test_connection_refused_is_transient(self):
+        exc = OperationalError('connection to server at "db" (10.0.0.1), port 5432 failed: Connection refused')
+        self.assertEqual(classify_error(exc, 'postgresql'), TRANSIENT)
+
+    def test_configuration_errors_are_permanent(self):
+        messages = [
+            'connection to server at "db" (10.0.0.1), port 5432 failed: '
+            'FATAL:  password authentication failed for user "report"',
+            'connection to server at "db" (10.0.0.1), port 5432 failed: FATAL:  database "reports" does not exist',
+            'could not translate host name "dbx" to address: Name or service not known',
+        ]
+        for message in messages:
+            with self.subTest(message=message):
+                self.assertEqual(classify_error(OperationalError(message), 'postgresql'), PERMANENT)
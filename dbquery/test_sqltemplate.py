@@ -0,0 +1,41 @@
+from django.test import SimpleTestCase
+
+from .executor import QueryStream
+from .sqltemplate import parse_template, render_bind
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, *args):
+        self.calls.append(args)
+
+
+class RenderBindTests(SimpleTestCase):
+    def test_literal_percent_without_bound_params(self):
+        # 水位内联、模板里只有字面量 % 时，没有绑定参数但 % 已被转义
+        tokens = parse_template("SELECT * FROM t_{{ watermark }} WHERE name LIKE 'x%'")
+        sql, params = render_bind(tokens, {'watermark': '202401'}, 'mysql')
+        self.assertEqual(sql, "SELECT * FROM t_202401 WHERE name LIKE 'x%%'")
+        self.assertEqual(params, [])
+
+    def test_empty_list_is_rejected(self):
+        tokens = parse_template('SELECT * FROM t WHERE id IN ({{ ids }})')
+        with self.assertRaises(ValueError):
+            render_bind(tokens, {'ids': []}, 'postgresql')
+
+
+class QueryStreamExecuteTests(SimpleTestCase):
+    def test_empty_params_are_passed_to_driver(self):
+        # 驱动只在传了参数时才把 %% 还原成 %
+        stream = QueryStream(conn=None, db_type='mysql')
+        stream.cursor = RecordingCursor()
+        stream.execute("SELECT * FROM t WHERE name LIKE 'x%%'", [])
+        self.assertEqual(stream.cursor.calls, [("SELECT * FROM t WHERE name LIKE 'x%%'", [])])
+
+    def test_inline_sql_is_executed_without_params(self):
+        stream = QueryStream(conn=None, db_type='mysql')
+        stream.cursor = RecordingCursor()
+        stream.execute("SELECT * FROM t WHERE name LIKE 'x%'")
+        self.assertEqual(stream.cursor.calls, [("SELECT * FROM t WHERE name LIKE 'x%'",)])
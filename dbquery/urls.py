@@ -4,6 +4,7 @@ from .views import (
     DatabaseConnectionViewSet,
     SQLParameterViewSet,
     QueryInstanceViewSet,
+    CompositeQueryViewSet,
     ExecutionResultViewSet,
     ExecutionLogList)
 
@@ -11,6 +12,7 @@ router = DefaultRouter()
 router.register(r'database-connections', DatabaseConnectionViewSet)
 router.register(r'sql-parameters', SQLParameterViewSet)
 router.register(r'query-instances', QueryInstanceViewSet)
+router.register(r'composite-queries', CompositeQueryViewSet)
 router.register(r'execution-results', ExecutionResultViewSet)
 
 urlpatterns = [
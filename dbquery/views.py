@@ -1,21 +1,32 @@
-import json
-
 from rest_framework import viewsets, filters, status, generics
 from rest_framework.decorators import action, authentication_classes, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import DatabaseConnection, SQLParameter, QueryInstance, ExecutionResult, ExecutionLog
+from .models import CompositeQuery, DatabaseConnection, SQLParameter, QueryInstance, ExecutionResult, ExecutionLog
 from .serializers import (
     DatabaseConnectionSerializer,
     SQLParameterSerializer,
     QueryInstanceSerializer,
+    CompositeQuerySerializer,
     ExecutionResultSerializer,
+    ExecutionResultListSerializer,
     PaginatedExecutionResultSerializer,
     ExecutionLogSerializer)
-import csv
-from django.http import HttpResponse
-from django.utils import timezone
+from .routing import cancel_execution, execute_composite_interactive, execute_interactive
+from .analytics import TABLE_NAME, AnalyticsError, run_query, table_columns
+from .delta import compute_changes
+from .export import EXPORT_FORMATS, export_response
+from .storage import (
+    count_rows,
+    get_column_meta,
+    get_columns,
+    has_rows,
+    read_rows,
+    read_sorted_rows,
+    rows_to_dicts,
+)
 from rest_framework.permissions import AllowAny
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -44,7 +55,7 @@ class SQLParameterViewSet(viewsets.ModelViewSet):
 @authentication_classes([])
 @permission_classes([AllowAny])
 class QueryInstanceViewSet(viewsets.ModelViewSet):
-    queryset = QueryInstance.objects.all()
+    queryset = QueryInstance.objects.select_related('connection').prefetch_related('parameters')
     serializer_class = QueryInstanceSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['connection']
@@ -54,8 +65,27 @@ class QueryInstanceViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def execute(self, request, pk=None):
         query_instance = self.get_object()
-        from .tasks import execute_query
-        task = execute_query.delay(query_instance.id)
+        # 手动执行走交互队列，不和定时任务、脚本排在一起
+        task = execute_interactive(query_instance)
+        return Response({
+            'status': '任务已提交',
+            'task_id': task.id
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+@authentication_classes([])
+@permission_classes([AllowAny])
+class CompositeQueryViewSet(viewsets.ModelViewSet):
+    queryset = CompositeQuery.objects.prefetch_related('source_links__query_instance')
+    serializer_class = CompositeQuerySerializer
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['name', 'description', 'sql']
+    ordering_fields = ['name', 'created_at']
+
+    @action(detail=True, methods=['post'])
+    def execute(self, request, pk=None):
+        composite_query = self.get_object()
+        task = execute_composite_interactive(composite_query)
         return Response({
             'status': '任务已提交',
             'task_id': task.id
@@ -67,10 +97,46 @@ class ExecutionResultViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ExecutionResult.objects.all()
     serializer_class = ExecutionResultSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['query_instance', 'status']
-    search_fields = ['query_instance__name', 'error_message']
+    filterset_fields = ['query_instance', 'composite_query', 'status']
+    search_fields = ['query_instance__name', 'composite_query__name', 'error_message']
     ordering_fields = ['created_at', 'execution_time']
     pagination_class = StandardResultsSetPagination
+    # 列表只返回执行信息，结果数据等大字段在 SQL 中就不读取
+    list_actions = ('list', 'latest')
+    # rows 接口单次最多返回的行数
+    max_rows_limit = 1000
+
+    def get_queryset(self):
+        queryset = super().get_queryset().select_related('query_instance', 'composite_query')
+        if self.action in self.list_actions:
+            queryset = queryset.defer(*ExecutionResultListSerializer.Meta.exclude)
+        elif self.action == 'retrieve' and self.request.query_params.get('fields'):
+            # ?fields= 没有要求的大字段不读取；formatted_result_data 需要内联存储的 result_data
+            wanted = {name.strip() for name in self.request.query_params['fields'].split(',')}
+            if 'formatted_result_data' in wanted:
+                wanted.add('result_data')
+            deferred = [name for name in ExecutionResultListSerializer.Meta.exclude if name not in wanted]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in self.list_actions:
+            return ExecutionResultListSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # 详情支持 ?offset=&limit= 只读取结果中的一段，分块存储时只会加载涉及的分块
+        params = self.request.query_params
+        if self.action == 'retrieve' and ('offset' in params or 'limit' in params):
+            try:
+                offset = max(int(params.get('offset', 0)), 0)
+                limit = max(int(params.get('limit', StandardResultsSetPagination.max_page_size)), 0)
+            except ValueError:
+                raise ValidationError({'error': 'offset/limit 必须是整数'})
+            context['row_slice'] = (offset, limit)
+        return context
 
     @action(detail=True, methods=['get'])
     def detail(self, request, pk=None):
@@ -82,64 +148,117 @@ class ExecutionResultViewSet(viewsets.ReadOnlyModelViewSet):
     def export(self, request, pk=None):
         execution_result = self.get_object()
 
-        if execution_result.status != 'success' or not execution_result.result_data:
+        if not has_rows(execution_result):
             return Response({
                 'error': '没有可导出的成功结果'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 创建CSV响应
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="result_{execution_result.id}_{timezone.now().strftime("%Y%m%d%H%M%S")}.csv"'
+        # ?type=csv|ndjson|xlsx，边读边输出，不在内存中拼出整个文件
+        file_type = request.query_params.get('type', 'csv')
+        if file_type not in EXPORT_FORMATS:
+            return Response({
+                'error': f'不支持的导出格式: {file_type}，可选 {", ".join(EXPORT_FORMATS)}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return export_response(execution_result, file_type)
+
+    @action(detail=True, methods=['get'])
+    def rows(self, request, pk=None):
+        """分页读取一个结果中的行：?offset=&limit=&order_by=列名（前面加 - 表示降序）
+
+        不排序时只读取覆盖这一段的分块或文件位置；排序时需要遍历整个结果，但只保留需要的行。
+        """
+        execution_result = self.get_object()
+        if execution_result.status != 'success':
+            return Response({'error': '只有成功的结果可以读取行'}, status=status.HTTP_400_BAD_REQUEST)
+        if execution_result.pruned:
+            return Response({'error': '结果已超过保留期限被清理'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 写入CSV数据
-        writer = csv.writer(response)
-        data = execution_result.result_data
+        params = request.query_params
+        try:
+            offset = max(int(params.get('offset', 0)), 0)
+            limit = min(max(int(params.get('limit', StandardResultsSetPagination.max_page_size)), 0), self.max_rows_limit)
+        except ValueError:
+            raise ValidationError({'error': 'offset/limit 必须是整数'})
 
-        # 统一处理字符串类型数据
-        if isinstance(data, str):
-            try:
-                # 参考前端逻辑，先尝试解析JSON字符串
-                parsed_data = json.loads(data)
-                data = parsed_data
-            except Exception as e:
-                print(f"JSON解析失败: {str(e)}")
-                data = [{'原始数据': data}]
-
-        # 确保数据结构统一
-        if not isinstance(data, list):
-            data = [data]
-
-        # 自动收集所有字段
-        field_set = set()
-        for item in data:
-            if isinstance(item, dict):
-                field_set.update(item.keys())
-        headers = sorted(field_set)
-
-        # 写入表头
-        writer.writerow(headers)
-
-        # 写入数据行
-        for item in data:
-            if isinstance(item, dict):
-                row = [item.get(field, '') for field in headers]
-            else:
-                row = [str(item)]
-            writer.writerow(row)
-
-        return response
+        columns = get_column_meta(execution_result)
+        names = [column['name'] for column in columns]
+        order_by = params.get('order_by', '')
+        if order_by:
+            descending = order_by.startswith('-')
+            name = order_by.lstrip('-')
+            if name not in names:
+                raise ValidationError({'error': f'结果中没有列 {name}'})
+            rows = read_sorted_rows(execution_result, names.index(name), descending, offset, limit)
+        else:
+            rows = read_rows(execution_result, offset, limit)
+
+        return Response({
+            'result': execution_result.id,
+            'columns': columns,
+            'row_count': count_rows(execution_result),
+            'offset': offset,
+            'limit': limit,
+            'order_by': order_by,
+            'rows': rows_to_dicts(names, rows) if params.get('shape') == 'legacy' else rows,
+        })
+
+    @action(detail=True, methods=['post'])
+    def analyze(self, request, pk=None):
+        """在结果上执行一条 SELECT：{"sql": "SELECT name, count(*) FROM result GROUP BY name"}
+
+        结果载入本地 SQLite 后在服务端计算，只返回查询的答案，见 analytics.py。
+        """
+        execution_result = self.get_object()
+        try:
+            answer = run_query(execution_result, request.data.get('sql'))
+        except AnalyticsError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'result': execution_result.id,
+            'table': TABLE_NAME,
+            'source_columns': table_columns(execution_result),
+            **answer,
+        })
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """取消执行中或等待重试的查询，目标库上正在运行的语句也会被取消"""
+        execution_result = self.get_object()
+        if not cancel_execution(execution_result):
+            return Response({'error': '只有执行中或等待重试的结果可以取消'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'status': '已发送取消请求'}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def changes(self, request, pk=None):
+        """与同一查询上一次成功结果相比新增和删除的行"""
+        execution_result = self.get_object()
+        if execution_result.status != 'success':
+            return Response({'error': '只有成功的结果可以比较'}, status=status.HTTP_400_BAD_REQUEST)
+        if execution_result.pruned:
+            return Response({'error': '结果已超过保留期限被清理'}, status=status.HTTP_400_BAD_REQUEST)
+
+        previous, inserted, deleted = compute_changes(execution_result)
+        data = {
+            'result': execution_result.id,
+            'previous_result': previous.id if previous is not None else None,
+            'columns': get_column_meta(execution_result),
+            'inserted_count': len(inserted),
+            'deleted_count': len(deleted),
+        }
+        if request.query_params.get('shape') == 'legacy':
+            names = get_columns(execution_result)
+            data['inserted'] = rows_to_dicts(names, inserted)
+            data['deleted'] = rows_to_dicts(names, deleted)
+        else:
+            data['inserted'] = inserted
+            data['deleted'] = deleted
+        return Response(data)
 
     @action(detail=False, methods=['get'])
     def latest(self, request):
-        # 获取每个查询实例的最新执行结果
-        latest_results = []
-        query_instances = QueryInstance.objects.all()
-        for q in query_instances:
-            latest_result = q.results.order_by('-created_at').first()
-            if latest_result:
-                latest_results.append(latest_result)
-
-        # 分页处理
+        # 每个查询实例的最新执行结果，通过查询实例上的 latest_result 一次查出并在数据库中分页
+        latest_results = self.get_queryset().filter(latest_for__isnull=False).order_by('-created_at', '-pk')
+
         page = self.paginate_queryset(latest_results)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -155,7 +274,7 @@ class ExecutionLogList(generics.ListAPIView):
     serializer_class = ExecutionLogSerializer
 
     def get_queryset(self):
-        queryset = ExecutionLog.objects.all().order_by('-executed_at')
+        queryset = ExecutionLog.objects.select_related('script', 'triggered_by').order_by('-executed_at')
 
         # 过滤条件
         status = self.request.query_params.get('status', None)
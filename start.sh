@@ -12,8 +12,14 @@ python manage.py migrate
 # 启动Django应用并将日志输出到文件
 python manage.py runserver 0.0.0.0:8000 > /app/logs/django.log 2>&1 &
 
-# 启动Celery Worker并将日志输出到文件
-celery -A dbq_project worker -l info > /app/logs/celery_worker.log 2>&1 &
+# 启动Celery Worker并将日志输出到文件，每类队列一组worker，并发数可通过环境变量调整
+# 交互式查询：页面上手动触发的执行
+celery -A dbq_project worker -n interactive@%h -Q dbq.interactive -c ${CELERY_INTERACTIVE_CONCURRENCY:-4} -l info > /app/logs/celery_interactive.log 2>&1 &
+# 定时查询：按数据库类型划分，Oracle批量任务单独一组；CELERY_EXTRA_QUEUES 可追加连接的专用队列
+celery -A dbq_project worker -n scheduled@%h -Q celery,dbq.mysql,dbq.postgresql,dbq.sqlserver${CELERY_EXTRA_QUEUES:+,$CELERY_EXTRA_QUEUES} -c ${CELERY_SCHEDULED_CONCURRENCY:-8} -l info > /app/logs/celery_worker.log 2>&1 &
+celery -A dbq_project worker -n oracle@%h -Q dbq.oracle -c ${CELERY_ORACLE_CONCURRENCY:-2} -l info > /app/logs/celery_oracle.log 2>&1 &
+# 脚本执行
+celery -A dbq_project worker -n scripts@%h -Q dbq.scripts -c ${CELERY_SCRIPTS_CONCURRENCY:-2} -l info > /app/logs/celery_scripts.log 2>&1 &
 
 # 启动Celery Beat并将日志输出到文件
 celery -A dbq_project beat -l info > /app/logs/celery_beat.log 2>&1 &